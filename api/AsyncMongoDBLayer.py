@@ -0,0 +1,301 @@
+from pymongo import AsyncMongoClient, CursorType, ReturnDocument
+from pymongo.errors import CollectionInvalid, ConnectionFailure, OperationFailure
+
+from MongoDBLayer import DataManager
+from metrics import MongoCommandMetrics
+from search import build_projection, build_search_query
+
+class AsyncMongoDBLayer(DataManager):
+    """
+    Asynchronous counterpart of MongoDBLayer built on pymongo's async client.
+    Every data access method is a coroutine, so callers running on the event
+    loop never block a worker thread while waiting for MongoDB.
+    """
+    def __init__(self, uri, db_name):
+        try:
+            self.client = AsyncMongoClient(uri, event_listeners=[MongoCommandMetrics()])
+            self.db = self.client[db_name]
+            print("Connected to MongoDB successfully.")
+        except ConnectionFailure as e:
+            print(f"Connection failed: {e}")
+
+
+    async def close_connection(self):
+        """
+        Closes the MongoDB client connection.
+        """
+        await self.client.close()
+        print("MongoDB connection closed.")
+
+
+    async def insertDocuments(self, collection_name, documents):
+        """
+        Inserts one or multiple documents into the collection.
+        :param collection_name: Name of the collection.
+        :param documents: dict or list of dicts representing the documents to insert.
+        :return: Inserted IDs.
+        """
+        collection = self.db[collection_name]
+        if isinstance(documents, list):
+            result = await collection.insert_many(documents)
+            return result.inserted_ids
+        else:
+            result = await collection.insert_one(documents)
+            return result.inserted_id
+
+    async def searchDocument(self, collection_name, query):
+        """
+        Searches for documents that match the query.
+        :param collection_name: Name of the collection.
+        :param query: dict representing the query.
+        :return: List of matching documents.
+        """
+        collection = self.db[collection_name]
+        return await collection.find(query).to_list()
+
+    def textCursor(self, collection_name, filter_query, search_text, fields=None, sort=None, skip=0, limit=None):
+        """
+        Builds the cursor for a full-text search on the collection's text index.
+        Supports stemmed terms, "quoted phrases" and prefix* terms.
+        :param collection_name: Name of the collection.
+        :param filter_query: dict with additional filters.
+        :param search_text: Text to search for, None returns all filtered documents.
+        :param fields: List of fields to return, None returns the full document.
+        :param sort: 'relevance', a list of (field, direction) or None for
+                     relevance when searching and natural order otherwise.
+        :param skip: Number of documents to skip.
+        :param limit: Maximum number of documents, None for all.
+        :return: Cursor over the matching documents.
+        """
+        final_query = dict(filter_query)
+        with_score = False
+        if search_text is not None:
+            search_query, with_score = build_search_query(search_text)
+            final_query.update(search_query)
+        collection = self.db[collection_name]
+        cursor = collection.find(final_query, build_projection(fields, with_score))
+        if with_score and sort in (None, "relevance"):
+            cursor = cursor.sort([("score", {"$meta": "textScore"})])
+        elif isinstance(sort, list):
+            cursor = cursor.sort(sort)
+        if skip > 0:
+            cursor = cursor.skip(skip)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        return cursor
+
+    async def searchText(self, collection_name, filter_query, search_text, fields=None, sort=None, skip=0, limit=None):
+        """
+        Full-text search, see textCursor for the parameters.
+        :return: List of matching documents.
+        """
+        cursor = self.textCursor(collection_name, filter_query, search_text, fields, sort, skip, limit)
+        return await cursor.to_list()
+
+    async def iterText(self, collection_name, filter_query, search_text, fields=None, sort=None, skip=0, limit=None):
+        """
+        Full-text search, see textCursor for the parameters.
+        :return: Async iterator of matching documents.
+        """
+        cursor = self.textCursor(collection_name, filter_query, search_text, fields, sort, skip, limit)
+        async for doc in cursor:
+            yield doc
+
+    async def updateDocument(self, collection_name, query, update, many=False):
+        """
+        Updates one or multiple documents that match the query.
+        :param collection_name: Name of the collection.
+        :param query: dict representing the query.
+        :param update: dict representing the update operation.
+        :param many: Boolean indicating whether to update multiple documents.
+        :return: Matched and modified document count.
+        """
+        collection = self.db[collection_name]
+        update_set = {"$set": update}
+        if many:
+            result = await collection.update_many(query, update_set)
+        else:
+            result = await collection.update_one(query, update_set)
+        return {
+            "matched_count": result.matched_count,
+            "modified_count": result.modified_count
+        }
+
+    async def deleteDocument(self, collection_name, query, many=False):
+        """
+        Deletes one or multiple documents that match the query.
+        :param collection_name: Name of the collection.
+        :param query: dict representing the query.
+        :param many: Boolean indicating whether to delete multiple documents.
+        :return: Count of deleted documents.
+        """
+        collection = self.db[collection_name]
+        if many:
+            result = await collection.delete_many(query)
+        else:
+            result = await collection.delete_one(query)
+        return result.deleted_count
+
+    async def fetchTopicWithPipeline(self, pipeline, collection_name):
+        collection = self.db[collection_name]
+        cursor = await collection.aggregate(pipeline)
+        topics = await cursor.to_list()
+
+        return topics
+
+    async def createIndexes(self, collection_name, indexes):
+        """
+        Creates the given indexes on the collection. Indexes that already exist
+        with the same name and options are left untouched.
+        :param collection_name: Name of the collection.
+        :param indexes: list of pymongo IndexModel.
+        :return: Names of the indexes.
+        """
+        collection = self.db[collection_name]
+        return await collection.create_indexes(indexes)
+
+    async def explainQuery(self, collection_name, query):
+        """
+        Returns the explain() output for a find query.
+        :param collection_name: Name of the collection.
+        :param query: dict representing the query.
+        :return: Explain document.
+        """
+        collection = self.db[collection_name]
+        return await collection.find(query).explain()
+
+    async def iterDocuments(self, collection_name, query, projection=None, batch_size=1000):
+        """
+        Iterates over the documents that match the query without loading them all.
+        :param collection_name: Name of the collection.
+        :param query: dict representing the query.
+        :param projection: Optional projection dict.
+        :param batch_size: Number of documents per round trip.
+        :return: Async iterator of documents.
+        """
+        collection = self.db[collection_name]
+        async for doc in collection.find(query, projection, batch_size=batch_size):
+            yield doc
+
+    async def bulkWrite(self, collection_name, operations, ordered=False):
+        """
+        Executes a list of write operations in one round trip.
+        :param collection_name: Name of the collection.
+        :param operations: list of pymongo write operations (UpdateOne, ...).
+        :param ordered: Stop at the first error when True.
+        :return: BulkWriteResult.
+        """
+        collection = self.db[collection_name]
+        return await collection.bulk_write(operations, ordered=ordered)
+
+    async def findOneAndUpdate(self, collection_name, query, update, projection=None):
+        """
+        Atomically updates one document and returns it as it was before the update.
+        :param collection_name: Name of the collection.
+        :param query: dict representing the query.
+        :param update: dict representing the update operation.
+        :param projection: Optional projection for the returned document.
+        :return: The document before the update or None if nothing matched.
+        """
+        collection = self.db[collection_name]
+        return await collection.find_one_and_update(query, {"$set": update},
+                                                    projection=projection,
+                                                    return_document=ReturnDocument.BEFORE)
+
+    async def findBatch(self, collection_name, query, projection=None, sort=None, limit=0):
+        """
+        Returns one sorted batch of the documents that match the query.
+        :param collection_name: Name of the collection.
+        :param query: dict representing the query.
+        :param projection: Optional projection dict.
+        :param sort: Optional list of (field, direction).
+        :param limit: Maximum number of documents, 0 for all.
+        :return: List of matching documents.
+        """
+        collection = self.db[collection_name]
+        cursor = collection.find(query, projection)
+        if sort is not None:
+            cursor = cursor.sort(sort)
+        return await cursor.limit(limit).to_list()
+
+    async def upsertDocument(self, collection_name, query, update):
+        """
+        Updates the document that matches the query or inserts it.
+        :param collection_name: Name of the collection.
+        :param query: dict representing the query.
+        :param update: dict of fields to set.
+        :return: Matched document count.
+        """
+        collection = self.db[collection_name]
+        result = await collection.update_one(query, {"$set": update}, upsert=True)
+        return result.matched_count
+
+    async def dropIndex(self, collection_name, index_name):
+        """
+        Drops an index by name.
+        :param collection_name: Name of the collection.
+        :param index_name: Name of the index.
+        :return: True if the index existed and was dropped.
+        """
+        collection = self.db[collection_name]
+        try:
+            await collection.drop_index(index_name)
+            return True
+        except OperationFailure as e:
+            if e.code in (26, 27):  # NamespaceNotFound, IndexNotFound
+                return False
+            raise
+
+    async def compactCollection(self, collection_name):
+        """
+        Runs the compact command, which releases the space of deleted documents.
+        :param collection_name: Name of the collection.
+        :return: Bytes freed as reported by the server.
+        """
+        result = await self.db.command("compact", collection_name)
+        return result.get("bytesFreed", 0)
+
+    async def incrementDocument(self, collection_name, query, increments, many=False):
+        """
+        Increments numeric fields of the documents that match the query.
+        :param collection_name: Name of the collection.
+        :param query: dict representing the query.
+        :param increments: dict of field -> amount, negative amounts decrement.
+        :param many: Boolean indicating whether to update multiple documents.
+        :return: Matched document count.
+        """
+        collection = self.db[collection_name]
+        if many:
+            result = await collection.update_many(query, {"$inc": increments})
+        else:
+            result = await collection.update_one(query, {"$inc": increments})
+        return result.matched_count
+
+    async def createCappedCollection(self, collection_name, size_bytes):
+        """
+        Creates a capped collection if it does not exist yet.
+        :param collection_name: Name of the collection.
+        :param size_bytes: Maximum size of the collection.
+        :return: True if the collection was created.
+        """
+        try:
+            await self.db.create_collection(collection_name, capped=True, size=size_bytes)
+            return True
+        except CollectionInvalid:
+            return False
+
+    async def tailDocuments(self, collection_name, query=None, max_await_ms=1000):
+        """
+        Follows a capped collection in insertion order and yields documents as
+        they are inserted. Returns when the cursor dies, callers reopen it.
+        :param collection_name: Name of the capped collection.
+        :param query: Optional filter, e.g. to skip documents older than a resume point.
+        :param max_await_ms: How long the server waits for new documents per getMore.
+        :return: Async iterator of documents.
+        """
+        collection = self.db[collection_name]
+        query = query or {}
+        cursor = collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT).max_await_time_ms(max_await_ms)
+        while cursor.alive:
+            async for doc in cursor:
+                yield doc
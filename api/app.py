@@ -1,18 +1,25 @@
 from main_app import MainApp
-
-from typing import List, Dict
+from pagination import NEXT_CURSOR_HEADER, Page
+from changes import ChangesPage, SinceExpired
+from search import has_text_search
+from audio_store import AudioNotModified, AudioRangeNotSatisfiable, parse_range
+from audio_cache import DiskAudioCache
+from serialization import ZaiaJSONResponse, dumps, dumps_line
+from metrics import AUDIO_CACHE_BYTES, MetricsMiddleware, mark_process_dead, render_metrics
+
+from typing import List, Dict, Union
 import os
-from io import BytesIO
+import asyncio
 import uuid
 import time
 
 
 from pydantic import BaseModel, Field
-from fastapi import FastAPI, Depends, HTTPException, status, APIRouter, UploadFile, File, Form
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, Depends, HTTPException, status, APIRouter, UploadFile, File, Form, Header, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jose import JWTError, jwt
-import boto3
+from jose import JWTError
 
 
 class CommentUpdateRequest(BaseModel):
@@ -27,6 +34,14 @@ class MarkedUpdateRequest(BaseModel):
     id: str
     is_marked: bool
 
+class BulkItemOperation(BaseModel):
+    id: str
+    op: str
+    value: Union[bool, List[Dict], None] = None
+
+class BulkUpdateRequest(BaseModel):
+    operations: List[BulkItemOperation]
+
 class Item(BaseModel):
     id: str
     topic_id: str
@@ -87,11 +102,10 @@ class JournalUpdateRequest(BaseModel):
     updated_text: str
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-def get_current_user(token: str = Depends(oauth2_scheme)):
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     """Authenticate the user from the token"""
     try:
-        payload = jwt.decode(token, main_app.settings.ZAIA_SECRET_KEY, algorithms=[main_app.algorithm])
-        username: str = payload.get("sub")
+        username = main_app.verify_access_token(token)
         if username is None:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -105,7 +119,81 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
             detail="Invalid token",
             headers={"WWW-Authenticate": "Bearer"},
         )
-app = FastAPI()
+
+def get_page(search_term, limit, cursor, sort, fields):
+    """Build the pagination request, invalid parameters are a client error"""
+    try:
+        return Page(limit=limit, cursor=cursor, sort=sort, fields=fields,
+                    has_text_search=has_text_search(search_term))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def json_response(content, next_cursor=None):
+    """
+    Serialize raw MongoDB documents with orjson. The body stays a plain list,
+    the cursor of the next page travels in a header.
+    """
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor is not None else None
+    return ZaiaJSONResponse(content, headers=headers)
+
+def etag_matches(if_none_match, etag):
+    return if_none_match is not None and (if_none_match.strip() == "*" or
+                                          etag in [tag.strip() for tag in if_none_match.split(",")])
+
+async def cached_topics_response(key, user, if_none_match, load):
+    """
+    Topic listings are rendered once and served from memory until a topic or
+    its item counts change. A client sending the current ETag gets a 304
+    without any database work.
+    :param load: Coroutine function returning the topics on a cache miss.
+    """
+    cache = main_app.topic_responses
+    entry = cache.get(key)
+    if entry is None:
+        generation = cache.generation
+        topics = await load()
+        entry = cache.set(key, dumps(topics), user=user,
+                          topic_ids=[x.get('id') for x in topics], generation=generation)
+    # no-cache: clients keep the body but revalidate it on every open
+    headers = {"ETag": entry.etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+async def ndjson_lines(documents):
+    async for doc in documents:
+        yield dumps_line(doc)
+
+def ndjson_response(documents):
+    """Stream documents as newline delimited JSON while the cursor is iterated"""
+    return StreamingResponse(ndjson_lines(documents), media_type="application/x-ndjson")
+
+SSE_KEEPALIVE_SEC = 15
+
+async def topic_event_lines(user):
+    """
+    Topic events of the user, or of all users for the extractor's account.
+    :param user: Authenticated user the stream is for.
+    """
+    all_users = bool(main_app.settings.ZAIA_API_USER) and user == main_app.settings.ZAIA_API_USER
+    queue = main_app.topic_subscribers.subscribe()
+    try:
+        yield "retry: 1000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SEC)
+            except asyncio.TimeoutError:
+                # comment line, keeps proxies from closing an idle stream
+                yield ": keepalive\n\n"
+                continue
+            if not all_users and event.get("user") != user:
+                continue
+            yield f"event: {event['kind']}\ndata: {dumps(event).decode()}\n\n"
+    finally:
+        main_app.topic_subscribers.unsubscribe(queue)
+
+app = FastAPI(default_response_class=ZaiaJSONResponse)
+app.add_middleware(MetricsMiddleware)
 main_app = MainApp()
 
 router = APIRouter(dependencies=[Depends(get_current_user)])
@@ -113,39 +201,39 @@ router = APIRouter(dependencies=[Depends(get_current_user)])
 
 # API Endpoints
 @app.post("/signup")
-def signup(user: UserCreate):
+async def signup(user: UserCreate):
     code = main_app.settings.LOGIN_CODE
     if user.code != code:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="You are not authorized to create user",
         )
-    if main_app.get_user(user.username):
+    if await main_app.get_user(user.username):
         raise HTTPException(status_code=400, detail="User already exists")
     
-    return main_app.create_user(user.username, user.password)
+    return await main_app.create_user(user.username, user.password)
 
 @app.post("/token")
-def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = main_app.authenticate_user(form_data.username, form_data.password)
+async def login(form_data: OAuth2PasswordRequestForm = Depends()):
+    user = await main_app.authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
         )
     access_token = main_app.create_access_token(data={"sub": user["username"]})
-    refresh_token = main_app.create_refresh_token(user["username"])
+    refresh_token = await main_app.create_refresh_token(user["username"])
     return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
 
 @app.put("/update_password")
-def update_password(user: UserCreate):
+async def update_password(user: UserCreate):
     code = main_app.settings.LOGIN_CODE
     if user.code != code:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="You are not authorized to change the password",
         )
-    result = main_app.update_password(user.username, user.password)
+    result = await main_app.update_password(user.username, user.password)
     if len(result)==0:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -155,116 +243,233 @@ def update_password(user: UserCreate):
     return result
 
 @router.get("/items/")
-def get_items(user: str, search_term: str=None, topic_id: str = None, is_marked: bool = None, only_with_comments: bool = None):
+async def get_items(user: str, search_term: str=None, topic_id: str = None, is_marked: bool = None, only_with_comments: bool = None,
+                    limit: int = None, cursor: str = None, sort: str = None, fields: str = None, stream: bool = False):
     """Fetch items from the database based on a search term."""
-    return main_app.get_items(user = user,
+    page = get_page(search_term, limit, cursor, sort, fields)
+    if stream:
+        return ndjson_response(main_app.stream_items(user = user,
+                                                     search_term = search_term,
+                                                     topic_id = topic_id,
+                                                     is_marked = is_marked,
+                                                     only_with_comments = only_with_comments,
+                                                     page = page))
+    result, next_cursor = await main_app.get_items(user = user,
                               search_term= search_term, 
                               topic_id = topic_id, 
                               is_marked = is_marked,
-                              only_with_comments = only_with_comments)
+                              only_with_comments = only_with_comments,
+                              page = page)
+    return json_response(result, next_cursor)
 
 @router.get("/multi_items/")
-def get_multi_items(user: str, search_term: str=None, topic_id: str = None, is_marked: bool = None):
+async def get_multi_items(user: str, search_term: str=None, topic_id: str = None, is_marked: bool = None,
+                          limit: int = None, cursor: str = None, sort: str = None, fields: str = None, stream: bool = False):
     """Fetch items from the database based on a search term."""
-    return main_app.get_multi_items(user = user,
+    page = get_page(search_term, limit, cursor, sort, fields)
+    if stream:
+        return ndjson_response(main_app.stream_multi_items(user = user,
+                                                           search_term = search_term,
+                                                           topic_id = topic_id,
+                                                           is_marked = is_marked,
+                                                           page = page))
+    result, next_cursor = await main_app.get_multi_items(user = user,
                               search_term= search_term, 
                               topic_id = topic_id, 
-                              is_marked = is_marked)
+                              is_marked = is_marked,
+                              page = page)
+    return json_response(result, next_cursor)
+
+@router.get("/changes/")
+async def get_changes(user: str, since: float = 0, cursor: str = None, limit: int = None):
+    """
+    Topics, items, multi items and journals changed since the client's watermark.
+    Call again with next_cursor until it is null, then keep watermark as the next since.
+    A since older than the retention period gets a 410, start over with since=0.
+    """
+    try:
+        page = ChangesPage(since=since, cursor=cursor, limit=limit,
+                           retention_days=main_app.settings.RETENTION_DAYS)
+    except SinceExpired:
+        raise HTTPException(status_code=410, detail="since is older than the retention period, sync again with since=0")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return json_response(await main_app.get_changes(user, page))
 
 @router.get("/items_old/")
-def get_items_old(user: str, search_term: str=None, topic_id: int = None, is_marked: bool = None, only_with_comments: bool = None):
+async def get_items_old(user: str, search_term: str=None, topic_id: int = None, is_marked: bool = None, only_with_comments: bool = None):
     """Fetch items from the database based on a search term."""
-    return main_app.get_items(user = user,
+    result, _ = await main_app.get_items(user = user,
                               search_term= search_term, 
                               topic_id = topic_id, 
                               is_marked = is_marked,
                               only_with_comments = only_with_comments)
+    return json_response(result)
 
 @router.put("/update_comment/")
-def update_comment(request: CommentUpdateRequest):
+async def update_comment(request: CommentUpdateRequest):
     """Update a comment for a specific id."""
-    main_app.update_comment(request.id, request.comments)
+    await main_app.update_comment(request.id, request.comments)
     return {"status": "Comment updated successfully"}
 
 @router.put("/update_journal_item/")
-def update_journal_item(request: JournalUpdateRequest):
+async def update_journal_item(request: JournalUpdateRequest):
     """Update a journal for a specific id."""
-    main_app.update_journal_item(request.id, request.updated_text)
+    await main_app.update_journal_item(request.id, request.updated_text)
     return {"status": "Journal updated successfully"}
 
+@router.post("/bulk_update_items/")
+async def bulk_update_items(request: BulkUpdateRequest):
+    """Apply done/marked/comment/delete/delete_multi operations to many items at once."""
+    try:
+        results = await main_app.bulk_update_items([x.model_dump() for x in request.operations])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"results": results}
+
 @router.put("/update_done/")
-def update_done(request: DoneUpdateRequest):
+async def update_done(request: DoneUpdateRequest):
     """Mark tasks as done."""
-    main_app.update_done(request.id, request.is_done)
+    await main_app.update_done(request.id, request.is_done)
     return {"status": "Task marked as done"}
 
-@router.on_event("shutdown")
-def shutdown_event():
+@app.on_event("startup")
+async def startup_event():
+    """Make sure the indexes backing the API queries exist and start listening for events."""
+    await main_app.ensure_indexes()
+    await main_app.start_background_tasks()
+
+@app.on_event("shutdown")
+async def shutdown_event():
     """Close database connection when the API shuts down."""
-    main_app.closeConnection()
+    await main_app.stop_background_tasks()
+    await main_app.closeConnection()
+    mark_process_dead(os.getpid())
 
 
 # Path to the folder containing MP3 files
 MP3_FOLDER = os.path.join(os.path.dirname(__file__), "All")
+audio_cache = DiskAudioCache(main_app.audio_store, MP3_FOLDER, main_app.settings.AUDIO_CACHE_MAX_BYTES)
 
 @router.get("/download_mp3/{mp3_file}")
-def download_mp3(mp3_file: str):
-    s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=main_app.settings.S3_ACCESS_KEY,
-    aws_secret_access_key=main_app.settings.S3_SECRET_KEY,
-    region_name=main_app.settings.S3_REGION,
-)
+async def download_mp3(mp3_file: str, range: str = Header(None), if_none_match: str = Header(None)):
+    if audio_cache.enabled:
+        try:
+            path = await audio_cache.lookup(mp3_file)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="File not found in S3")
+        if path is None:
+            # Miss: stream from S3 and fill the cache with the same bytes
+            return await run_in_threadpool(stream_mp3_from_s3, mp3_file, range, if_none_match, audio_cache)
+        try:
+            return await run_in_threadpool(cached_mp3_response, path, mp3_file, if_none_match)
+        except FileNotFoundError:
+            # Evicted since the lookup, S3 still has it
+            pass
+    return await run_in_threadpool(stream_mp3_from_s3, mp3_file, range, if_none_match)
+
+def cached_mp3_response(path, mp3_file, if_none_match):
+    """Serve a cached file with sendfile, FileResponse answers Range requests itself"""
+    response = FileResponse(path, media_type="audio/mpeg", filename=mp3_file, stat_result=os.stat(path))
+    etag = response.headers["etag"]
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return response
+
+def stream_mp3_from_s3(mp3_file, range, if_none_match, cache=None):
+    """
+    Stream an MP3 from S3 to the client.
+    :param cache: Optional DiskAudioCache the streamed bytes are written to.
+    """
+    byte_range = parse_range(range)
     try:
-        # Try to retrieve the file from S3
-        response = s3_client.get_object(Bucket=main_app.settings.S3_BUCKET_NAME, Key=f"All/{mp3_file}")
-        
-        # Get the file content and create a BytesIO object to stream it
-        file_content = response['Body'].read()
-        file_stream = BytesIO(file_content)
-        
-        # Return the file as a streaming response
-        return StreamingResponse(file_stream, media_type="audio/mpeg", headers={"Content-Disposition": f"attachment; filename={mp3_file}"})
-    
-    except s3_client.exceptions.NoSuchKey:
+        # Open the object in S3, the body is streamed to the client chunk by chunk
+        try:
+            response = main_app.audio_store.get_object(mp3_file, byte_range=byte_range, if_none_match=if_none_match)
+        except AudioNotModified as e:
+            # Answer with the object's own ETag, only when it is one the client sent
+            if e.etag and etag_matches(if_none_match, e.etag):
+                return Response(status_code=304, headers={"ETag": e.etag})
+            response = main_app.audio_store.get_object(mp3_file, byte_range=byte_range)
+    except AudioRangeNotSatisfiable:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable")
+    except FileNotFoundError:
         # If the file does not exist in S3, raise a 404 error
         raise HTTPException(status_code=404, detail="File not found in S3")
 
+    headers = {"Content-Disposition": f"attachment; filename={mp3_file}",
+               "Accept-Ranges": "bytes",
+               "ETag": response["ETag"],
+               "Content-Length": str(response["ContentLength"])}
+    status_code = 200
+    if "ContentRange" in response:
+        headers["Content-Range"] = response["ContentRange"]
+        status_code = 206
+    body = main_app.audio_store.iter_body(response)
+    if cache is not None:
+        body = cache.tee(mp3_file, response, body)
+    return StreamingResponse(body, status_code=status_code,
+                             media_type="audio/mpeg", headers=headers)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint, merges all workers when PROMETHEUS_MULTIPROC_DIR is set."""
+    AUDIO_CACHE_BYTES.set(audio_cache.total_bytes)
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@router.get("/audio_cache/stats")
+async def get_audio_cache_stats():
+    """Hit rate and size of the local MP3 cache of this worker."""
+    return audio_cache.stats()
+
 @router.get("/journals/")
-def get_journals(user: str = ""):
+async def get_journals(user: str = "", stream: bool = False):
     """Fetch journals from the database based on a user."""
-    return main_app.get_journals(user)    
+    if stream:
+        return ndjson_response(main_app.stream_journals(user))
+    return json_response(await main_app.get_journals(user))    
 
 @router.get("/topics/")
-def get_topics(topic_type: str = "", user: str = ""):
+async def get_topics(topic_type: str = "", user: str = "", stream: bool = False,
+                     if_none_match: str = Header(None)):
     """Fetch topics from the database based on a type and user."""
-    return main_app.get_topics(topic_type, user)
+    if stream:
+        return ndjson_response(main_app.stream_topics(topic_type, user))
+    return await cached_topics_response(("topics", user, topic_type), user, if_none_match,
+                                        lambda: main_app.get_topics(topic_type, user))
+
+@router.get("/topic_events/")
+async def topic_events(current_user: str = Depends(get_current_user)):
+    """Server-sent events for topic changes of the user, of all users for the extractor."""
+    return StreamingResponse(topic_event_lines(current_user), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @router.get("/all_topics/")
-def get_all_topics():
+async def get_all_topics(if_none_match: str = Header(None)):
     """Fetch topics from the database based on a type and user."""
-    return main_app.get_all_topics()
+    return await cached_topics_response(("all_topics",), None, if_none_match, main_app.get_all_topics)
 
 @router.post("/insert_items/")
-def insert_items(items: list[Item]):
+async def insert_items(items: list[Item]):
     """Insert  items for a specific source."""
     items_dict = [item.model_dump() for item in items]
     items_dict_with_isDeleted = [{**item, **{'is_deleted': False}} for item in items_dict] 
-    main_app.insert_items(items_dict_with_isDeleted)
+    await main_app.insert_items(items_dict_with_isDeleted)
     return {"status": "Items updated successfully"}
 
 @router.post("/insert_multi_items/")
-def insert_multi_items(items: list[MultiItem]):
+async def insert_multi_items(items: list[MultiItem]):
     """Insert multi items"""
     items_dict = [item.model_dump() for item in items]
     items_dict_with_isDeleted = [{**item, **{'is_deleted': False}} for item in items_dict] 
-    main_app.insert_multi_items(items_dict_with_isDeleted)
+    await main_app.insert_multi_items(items_dict_with_isDeleted)
     return {"status": "Items updated successfully"}
 
 @router.put("/update_topic/")
-def update_topic(request: TopicUpdateRequest):
+async def update_topic(request: TopicUpdateRequest):
     """Update a topic for a specific topic id."""
-    main_app.update_topic(id= request.id,
+    await main_app.update_topic(id= request.id,
                           frequency=request.frequency,
                           items = request.items,
                           last_extraction_epoch=request.last_extraction_epoch,
@@ -275,13 +480,13 @@ def update_topic(request: TopicUpdateRequest):
     return {"status": "Topic updated successfully"}
 
 @router.put("/mark_for_reading/")
-def mark_for_reading(request: MarkedUpdateRequest):
+async def mark_for_reading(request: MarkedUpdateRequest):
     """Mark tasks as done."""
-    main_app.update_marked(request.id, request.is_marked)
+    await main_app.update_marked(request.id, request.is_marked)
     return {"status": "Task marked"}
 
 @router.post("/insert_topic/")
-def insert_topic(topic:Topic):
+async def insert_topic(topic:Topic):
     """Insert  topic """
   
     topic_dic = topic.model_dump()
@@ -291,49 +496,56 @@ def insert_topic(topic:Topic):
     topic_dic['created_on'] =  int(now)
     topic_dic['modified_on'] = int(now)
     topic_dic['is_deleted'] = False
-    main_app.insert_topic(topic_dic)
+    await main_app.insert_topic(topic_dic)
     return {"status": "Items updated successfully"}
 
 
 @router.put("/delete_item/")
-def delete_item(id: str):
+async def delete_item(id: str):
     """delete_item."""
-    main_app.delete_item(id, is_multi_item=False)
+    await main_app.delete_item(id, is_multi_item=False)
     return {"status": "Item deleted"}
 
 @router.put("/delete_multi_item/")
-def delete_multi_item(id: str):
+async def delete_multi_item(id: str):
     """delete_item."""
-    main_app.delete_item(id, is_multi_item=True)
+    await main_app.delete_item(id, is_multi_item=True)
     return {"status": "Item deleted"}
 
 @router.put("/delete_topic/")
-def delete_topic(id: str):
+async def delete_topic(id: str):
     """delete_topic."""
-    main_app.delete_topic(id)
+    await main_app.delete_topic(id)
     return {"status": "Topic deleted"}
 
 @router.put("/delete_journal_item/")
-def delete_journal_item(id: str):
+async def delete_journal_item(id: str):
     """delete_topic."""
-    main_app.delete_journal_item(id)
+    await main_app.delete_journal_item(id)
     return {"status": "Journal deleted"}
 
-@router.put("/upload_audio/")
+@router.put("/upload_audio/", status_code=202)
 async def upload_audio(user: str = Form(...), audio: UploadFile = File(...)):
+    """Queue a voice note for transcription, the result is polled with /transcription_jobs/{job_id}."""
+    audio_data = await audio.read()
     try:
-        audio_data = await audio.read()
-        
-        response = main_app.speech_to_text(user, audio_data)
-        print(response)
-        return response
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        job = await main_app.transcriptions.submit(user, audio_data)
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail="Too many transcriptions in progress, try again later")
+    return {"job_id": job["id"], "status": job["status"]}
+
+@router.get("/transcription_jobs/{job_id}")
+async def get_transcription_job(job_id: str):
+    """Status of a transcription, once done it carries the transcript and the journal id."""
+    job = await main_app.transcriptions.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Transcription job not found")
+    return json_response(job)
 
 
 @app.post("/refresh")
-def refresh_access_token(request: RefreshTokenRequest):
-    username = main_app.validate_refresh_token(request.refresh_token)
+async def refresh_access_token(request: RefreshTokenRequest):
+    username = await main_app.validate_refresh_token(request.refresh_token)
     if username is None:
         raise HTTPException(status_code=401, detail="Invalid refresh token")
     
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+from metrics import AUDIO_CACHE_LOOKUPS
+
+MP3_SUFFIX = ".mp3"
+TMP_SUFFIX = ".tmp"
+FULL_RANGE_RE = re.compile(r"^bytes 0-(\d+)/(\d+)$")
+
+
+class DiskAudioCache:
+    """
+    Size bounded cache of MP3 files on local disk in front of S3.
+    The disk is the source of truth: a hit sets the file's atime and eviction
+    removes the files with the oldest atime, so several workers can share the
+    folder. A miss is streamed from S3 and written to the cache on the way,
+    the client does not wait for the whole download.
+    """
+    def __init__(self, audio_store, folder, max_bytes):
+        self.audio_store = audio_store
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.filling = set()
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger('Zaia')
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        if self.enabled:
+            os.makedirs(folder, exist_ok=True)
+            self.total_bytes = sum(x[2] for x in self.scan())
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def path(self, audio_name):
+        # only plain file names, never paths, end up on disk
+        if os.path.basename(audio_name) != audio_name or audio_name.startswith("."):
+            raise FileNotFoundError(audio_name)
+        return os.path.join(self.folder, audio_name)
+
+    async def lookup(self, audio_name):
+        """
+        Returns the local path of a cached file and marks it recently used.
+        :return: Path or None on a miss.
+        """
+        path = await asyncio.to_thread(self.touch, self.path(audio_name))
+        if path is None:
+            self.misses += 1
+            AUDIO_CACHE_LOOKUPS.labels("miss").inc()
+        else:
+            self.hits += 1
+            AUDIO_CACHE_LOOKUPS.labels("hit").inc()
+        return path
+
+    def touch(self, path):
+        try:
+            stat = os.stat(path)
+            # keep mtime, it is part of the ETag, and record the use in atime
+            os.utime(path, (time.time(), stat.st_mtime))
+        except FileNotFoundError:
+            return None
+        return path
+
+    def tee(self, audio_name, response, chunks):
+        """
+        Passes the chunks of an S3 response through and writes them to the
+        cache. The file is only added once the last chunk went through, a
+        client that disconnects earlier leaves nothing behind. Responses that
+        do not hold the whole object, and misses for a file another request
+        is already writing, are passed through only.
+        :param response: get_object response the chunks come from.
+        :return: Iterator of the chunks.
+        """
+        with self.lock:
+            fill = covers_object(response) and audio_name not in self.filling
+            if fill:
+                self.filling.add(audio_name)
+        if not fill:
+            self.coalesced += 1
+            AUDIO_CACHE_LOOKUPS.labels("coalesced").inc()
+            yield from chunks
+            return
+        path = self.path(audio_name)
+        tmp_path = f"{path}.{uuid.uuid4().hex}{TMP_SUFFIX}"
+        f = None
+        try:
+            # a cache that cannot be written must not break the download
+            try:
+                f = open(tmp_path, "wb")
+            except OSError as e:
+                self.logger.error(f"Audio cache failed for {audio_name}: {e}")
+            for chunk in chunks:
+                if f is not None:
+                    try:
+                        f.write(chunk)
+                    except OSError as e:
+                        self.logger.error(f"Audio cache failed for {audio_name}: {e}")
+                        f.close()
+                        f = None
+                yield chunk
+            if f is not None:
+                f.close()
+                f = None
+                try:
+                    self.add(path, tmp_path)
+                except OSError as e:
+                    self.logger.error(f"Audio cache failed for {audio_name}: {e}")
+        finally:
+            if f is not None:
+                f.close()
+            # releases the S3 connection when the client went away early
+            chunks.close()
+            with self.lock:
+                self.filling.discard(audio_name)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def add(self, path, tmp_path):
+        """Moves a downloaded file into the cache, replacing a copy another worker may have written."""
+        try:
+            replaced_size = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced_size = 0
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.total_bytes += os.path.getsize(path) - replaced_size
+            evict = self.total_bytes > self.max_bytes
+        if evict:
+            self.evict()
+
+    def scan(self):
+        """Returns (path, atime, size) of every cached file."""
+        entries = []
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(MP3_SUFFIX):
+                    stat = entry.stat()
+                    entries.append((entry.path, stat.st_atime, stat.st_size))
+        return entries
+
+    def evict(self):
+        """Removes the least recently used files until the cache fits max_bytes."""
+        entries = sorted(self.scan(), key=lambda x: x[1])
+        total = sum(x[2] for x in entries)
+        for path, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        with self.lock:
+            self.total_bytes = total
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups > 0 else 0.0,
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes}
+
+
+def covers_object(response):
+    """True when a get_object response holds the whole object, e.g. for Range: bytes=0-."""
+    if "ContentRange" not in response:
+        return True
+    match = FULL_RANGE_RE.match(response["ContentRange"])
+    return match is not None and int(match.group(1)) + 1 == int(match.group(2))
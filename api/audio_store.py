@@ -0,0 +1,134 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from metrics import timed_call
+
+S3_PREFIX = "All"
+CHUNK_SIZE = 64 * 1024
+MAX_POOL_CONNECTIONS = 50
+MAX_DELETE_KEYS = 1000
+HEAD_WORKERS = 16
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class AudioNotModified(Exception):
+    def __init__(self, audio_name, etag=None):
+        super().__init__(audio_name)
+        self.etag = etag
+
+
+class AudioRangeNotSatisfiable(Exception):
+    pass
+
+
+class S3AudioStore:
+    """
+    Access to the MP3 files in S3. One client, and so one connection pool,
+    is shared by all requests of the worker.
+    """
+    def __init__(self, settings):
+        self.bucket_name = settings.S3_BUCKET_NAME
+        self.s3_client = boto3.client(
+            "s3",
+            aws_access_key_id=settings.S3_ACCESS_KEY,
+            aws_secret_access_key=settings.S3_SECRET_KEY,
+            region_name=settings.S3_REGION,
+            config=Config(max_pool_connections=MAX_POOL_CONNECTIONS,
+                          retries={"max_attempts": 3, "mode": "standard"}),
+        )
+
+    def key(self, audio_name):
+        return f"{S3_PREFIX}/{audio_name}"
+
+    def get_object(self, audio_name, byte_range=None, if_none_match=None):
+        """
+        Opens an MP3 in S3 without reading it.
+        :param audio_name: File name, e.g. <id>.mp3.
+        :param byte_range: Optional single HTTP range, e.g. bytes=0-1023.
+        :param if_none_match: Optional ETag the client already has.
+        :return: The get_object response, its Body is a stream.
+        :raises AudioNotModified: With the object's ETag when S3 answered 304.
+        """
+        kwargs = {"Bucket": self.bucket_name, "Key": self.key(audio_name)}
+        if byte_range is not None:
+            kwargs["Range"] = byte_range
+        if if_none_match is not None:
+            kwargs["IfNoneMatch"] = if_none_match
+        try:
+            # time to the response headers, the body is streamed afterwards
+            with timed_call("s3", "get_object"):
+                return self.s3_client.get_object(**kwargs)
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code in ("NoSuchKey", "404"):
+                raise FileNotFoundError(audio_name)
+            if code in ("NotModified", "304"):
+                etag = e.response.get("ResponseMetadata", {}).get("HTTPHeaders", {}).get("etag")
+                raise AudioNotModified(audio_name, etag)
+            if code in ("InvalidRange", "416"):
+                raise AudioRangeNotSatisfiable(audio_name)
+            raise
+
+    def iter_body(self, response, chunk_size=CHUNK_SIZE):
+        """Yields the object body in chunks and releases the connection at the end."""
+        body = response["Body"]
+        try:
+            for chunk in body.iter_chunks(chunk_size=chunk_size):
+                yield chunk
+        finally:
+            body.close()
+
+
+    def object_sizes(self, audio_names):
+        """
+        Sizes of the MP3s in S3, files that do not exist are left out.
+        :return: dict of audio name -> bytes.
+        """
+        def size(audio_name):
+            try:
+                with timed_call("s3", "head_object"):
+                    response = self.s3_client.head_object(Bucket=self.bucket_name, Key=self.key(audio_name))
+                return audio_name, response["ContentLength"]
+            except ClientError:
+                return audio_name, None
+
+        with ThreadPoolExecutor(max_workers=HEAD_WORKERS) as executor:
+            return {name: length for name, length in executor.map(size, audio_names) if length is not None}
+
+    def delete_objects(self, audio_names):
+        """
+        Deletes MP3s from S3, up to 1000 per request.
+        :return: Set of the audio names that could not be deleted.
+        """
+        failed = set()
+        for start in range(0, len(audio_names), MAX_DELETE_KEYS):
+            names = audio_names[start:start + MAX_DELETE_KEYS]
+            try:
+                with timed_call("s3", "delete_objects"):
+                    response = self.s3_client.delete_objects(
+                        Bucket=self.bucket_name,
+                        Delete={"Objects": [{"Key": self.key(x)} for x in names], "Quiet": True})
+            except ClientError:
+                failed.update(names)
+                continue
+            prefix_len = len(self.key(""))
+            failed.update(x["Key"][prefix_len:] for x in response.get("Errors", []))
+        return failed
+
+
+def parse_range(range_header):
+    """
+    Returns the Range header if it is a single byte range S3 can serve,
+    None otherwise (multiple ranges are answered with the full file).
+    """
+    if range_header is None:
+        return None
+    match = RANGE_RE.match(range_header.strip())
+    if match is None or (match.group(1) == "" and match.group(2) == ""):
+        return None
+    return range_header.strip()
@@ -0,0 +1,95 @@
+"""
+Auth fast path benchmark.
+
+Compares the request-path cost of the old and new authentication code:
+  * token: jwt.decode on every request vs MainApp.verify_access_token (cached)
+  * login burst: event loop latency seen by other requests while N bcrypt
+    verifications run inline on the loop vs on the password executor
+
+Runs without MongoDB, only the Settings env vars of the API are needed.
+Usage: python benchmarks/bench_auth.py [--tokens 20000] [--logins 16]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jose import jwt
+
+from main_app import MainApp, pwd_context
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def summarize(latencies_ms):
+    return {"p50_ms": round(percentile(latencies_ms, 0.50), 4),
+            "p99_ms": round(percentile(latencies_ms, 0.99), 4),
+            "max_ms": round(max(latencies_ms), 4),
+            "mean_ms": round(statistics.mean(latencies_ms), 4)}
+
+
+def bench_tokens(main_app, count):
+    token = main_app.create_access_token(data={"sub": "bench"})
+    before = []
+    for _ in range(count):
+        start = time.perf_counter()
+        jwt.decode(token, main_app.settings.ZAIA_SECRET_KEY, algorithms=[main_app.algorithm])
+        before.append((time.perf_counter() - start) * 1000)
+    after = []
+    for _ in range(count):
+        start = time.perf_counter()
+        main_app.verify_access_token(token)
+        after.append((time.perf_counter() - start) * 1000)
+    return {"before": summarize(before), "after": summarize(after)}
+
+
+async def probe_loop_latency(stop, latencies, interval=0.005):
+    """Measures how late a cheap coroutine wakes up, i.e. what other requests feel."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        latencies.append((time.perf_counter() - start - interval) * 1000)
+
+
+async def login_burst(verify, hashed, logins):
+    stop = asyncio.Event()
+    latencies = []
+    probe = asyncio.create_task(probe_loop_latency(stop, latencies))
+    start = time.perf_counter()
+    await asyncio.gather(*[verify("bench-password", hashed) for _ in range(logins)])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe
+    return {"burst_seconds": round(elapsed, 3), "loop_lag": summarize(latencies or [0.0])}
+
+
+async def bench_logins(main_app, logins):
+    hashed = pwd_context.hash("bench-password")
+
+    async def inline_verify(password, hashed_password):
+        return pwd_context.verify(password, hashed_password)
+
+    before = await login_burst(inline_verify, hashed, logins)
+    after = await login_burst(main_app.verify_password, hashed, logins)
+    return {"before": before, "after": after}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the auth fast path")
+    parser.add_argument("--tokens", type=int, default=20000, help="Token verifications to time")
+    parser.add_argument("--logins", type=int, default=16, help="Concurrent bcrypt verifications per burst")
+    args = parser.parse_args()
+
+    main_app = MainApp()
+    results = {"token_verification": bench_tokens(main_app, args.tokens),
+               "login_burst": asyncio.run(bench_logins(main_app, args.logins)),
+               "password_hash_workers": main_app.settings.PASSWORD_HASH_WORKERS}
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,116 @@
+"""
+Response serialization benchmark.
+
+Compares the old and new way an item list is turned into a response body:
+  * before: str(_id) loop, sanitize_data NaN/inf walk, FastAPI's
+    jsonable_encoder and JSONResponse (json.dumps)
+  * after: ZaiaJSONResponse (orjson) straight on the MongoDB documents
+and the same for the NDJSON stream (json.dumps per line vs dumps_line).
+
+Runs without MongoDB on synthetic documents shaped like Extraction items.
+Usage: python benchmarks/bench_serialization.py [--items 10000] [--rounds 10]
+"""
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from serialization import ZaiaJSONResponse, dumps_line
+
+
+def make_items(count):
+    now = time.time()
+    items = []
+    for i in range(count):
+        items.append({"_id": ObjectId(),
+                      "id": f"item-{i}",
+                      "topic_id": f"topic-{i % 20}",
+                      "item_name": "summary",
+                      "source": "https://example.com/news/article",
+                      "title": f"Sample title number {i}",
+                      "value": "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 8,
+                      "audio_name": f"item-{i}.mp3",
+                      "comments": [{"text": "nice", "created_on": now}] if i % 5 == 0 else [],
+                      "done": i % 2 == 0,
+                      "is_marked": i % 7 == 0,
+                      "is_deleted": False,
+                      "score": float("nan") if i % 100 == 0 else 1.5,
+                      "created_on": now - i,
+                      "modified_on": now - i})
+    return items
+
+
+def legacy_sanitize(data):
+    for record in data:
+        for key, value in record.items():
+            if isinstance(value, float):
+                if math.isnan(value) or math.isinf(value):
+                    record[key] = None
+    return data
+
+
+def before(items):
+    result = []
+    for doc in items:
+        doc = dict(doc)
+        doc["_id"] = str(doc["_id"])
+        result.append(doc)
+    result = legacy_sanitize(result)
+    return JSONResponse(jsonable_encoder(result)).body
+
+
+def after(items):
+    return ZaiaJSONResponse(items).body
+
+
+def before_ndjson(items):
+    lines = []
+    for doc in items:
+        doc = dict(doc)
+        doc["_id"] = str(doc["_id"])
+        lines.append(json.dumps(legacy_sanitize([doc])[0]) + "\n")
+    return lines
+
+
+def after_ndjson(items):
+    return [dumps_line(doc) for doc in items]
+
+
+def timed(func, items, rounds):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func(items)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": round(statistics.median(timings), 2),
+            "min_ms": round(min(timings), 2)}
+
+
+def compare(before_func, after_func, items, rounds):
+    old = timed(before_func, items, rounds)
+    new = timed(after_func, items, rounds)
+    return {"before": old, "after": new,
+            "speedup": round(old["median_ms"] / new["median_ms"], 1)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark API response serialization")
+    parser.add_argument("--items", type=int, default=10000, help="Documents per response")
+    parser.add_argument("--rounds", type=int, default=10, help="Timed repetitions")
+    args = parser.parse_args()
+
+    items = make_items(args.items)
+    results = {"items": args.items,
+               "response_bytes": len(after(items)),
+               "json_response": compare(before, after, items, args.rounds),
+               "ndjson_stream": compare(before_ndjson, after_ndjson, items, args.rounds)}
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,356 @@
+"""
+API load test.
+
+Seeds MongoDB with synthetic users, topics, items, multi items and journals,
+then drives a running API with a weighted mix of read and write requests at
+a fixed concurrency and reports p50/p95/p99 latency and throughput per
+endpoint as JSON. Runs are reproducible: the data and the request sequence
+only depend on --seed, so two builds can be compared on the same numbers.
+
+Uses the Settings env vars of the API (MONGO_URL, DB_NAME, ZAIA_SECRET_KEY).
+Seeded users are named loadtest-<n>, --reset removes everything they own;
+seeding again without it is refused, the ids would collide.
+
+Usage:
+  python benchmarks/loadtest.py seed [--users 10] [--topics 20] [--items 200] [--journals 100] [--reset]
+  python benchmarks/loadtest.py run [--base-url http://127.0.0.1:8000] [--concurrency 16]
+                                    [--requests 5000] [--mix read] [--output before.json]
+  python benchmarks/loadtest.py compare before.json after.json [--threshold 1.2]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from jose import jwt
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from main_app import Settings
+from search import TOKENS_FIELD, tokenize
+
+USER_PREFIX = "loadtest-"
+WORDS = ("market energy climate policy science health football election startup model "
+         "research budget transport housing water security music film travel weather").split()
+
+# endpoint name -> weight, per mix
+MIXES = {
+    "read": {"items": 30, "items_topic": 15, "items_search": 10, "multi_items": 15,
+             "topics": 15, "all_topics": 5, "journals": 10},
+    "write": {"update_done": 30, "mark_for_reading": 25, "update_comment": 20,
+              "bulk_update_items": 15, "update_journal_item": 10},
+}
+MIXES["mixed"] = {**{k: v * 4 for k, v in MIXES["read"].items()}, **MIXES["write"]}
+
+
+def user_name(n):
+    return f"{USER_PREFIX}{n}"
+
+
+def text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def connect(settings):
+    return MongoClient(settings.MONGO_URL)[settings.DB_NAME]
+
+
+def reset(db):
+    users = {"$regex": f"^{USER_PREFIX}"}
+    topic_ids = [x["id"] for x in db.Topic.find({"user": users}, {"id": 1})]
+    for collection_name in ("Extraction", "Extraction_Multi"):
+        db[collection_name].delete_many({"topic_id": {"$in": topic_ids}})
+    for collection_name in ("Topic", "Journal"):
+        db[collection_name].delete_many({"user": users})
+    db.User.delete_many({"username": users})
+
+
+def has_seeded_data(db):
+    users = {"$regex": f"^{USER_PREFIX}"}
+    return (db.User.find_one({"username": users}) is not None or
+            db.Topic.find_one({"user": users}) is not None)
+
+
+def seed(db, args):
+    """Inserts the synthetic data set, returns the number of documents per collection."""
+    rng = random.Random(args.seed)
+    now = int(time.time())
+    counts = {"User": 0, "Topic": 0, "Extraction": 0, "Extraction_Multi": 0, "Journal": 0}
+    for n in range(args.users):
+        user = user_name(n)
+        db.User.insert_one({"username": user, "password": "!"})
+        counts["User"] += 1
+        for _ in range(args.topics):
+            topic_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            is_multi_item = rng.random() < 0.3
+            items = []
+            for _ in range(args.items):
+                created_on = now - rng.randint(0, 90 * 86400)
+                item = {"id": str(uuid.UUID(int=rng.getrandbits(128))),
+                        "topic_id": topic_id,
+                        "source": f"https://example.com/{rng.getrandbits(32)}",
+                        "title": text(rng, 8),
+                        "comments": [],
+                        "done": rng.random() < 0.4,
+                        "is_marked": rng.random() < 0.1,
+                        "is_deleted": rng.random() < 0.05,
+                        "created_on": created_on,
+                        "modified_on": created_on}
+                if is_multi_item:
+                    item["items"] = [{"item_name": "summary", "value": text(rng, 40)}]
+                    item[TOKENS_FIELD] = tokenize(f"{item['title']} {item['items'][0]['value']}")
+                else:
+                    item.update({"item_name": "summary",
+                                 "value": text(rng, 80),
+                                 "audio_name": f"{item['id']}.mp3"})
+                    item[TOKENS_FIELD] = tokenize(f"{item['title']} {item['value']}")
+                items.append(item)
+            collection_name = "Extraction_Multi" if is_multi_item else "Extraction"
+            if len(items) > 0:
+                db[collection_name].insert_many(items)
+                counts[collection_name] += len(items)
+            live = [x for x in items if not x["is_deleted"]]
+            db.Topic.insert_one({"id": topic_id,
+                                 "user": user,
+                                 "topic_name": text(rng, 2),
+                                 "topic_type": rng.choice(["news", "research"]),
+                                 "frequency": rng.choice(["hourly", "daily"]),
+                                 "items": [{"item_name": "summary", "item_type": "text",
+                                            "value_type": "str", "num_values": 1}],
+                                 "is_multi_item": is_multi_item,
+                                 "last_extraction_epoch": now,
+                                 "total_items": 0 if is_multi_item else len(live),
+                                 "done_items": 0 if is_multi_item else sum(1 for x in live if x["done"]),
+                                 "total_multi_items": len(live) if is_multi_item else 0,
+                                 "is_deleted": False,
+                                 "created_on": now,
+                                 "modified_on": now})
+            counts["Topic"] += 1
+        journals = [{"id": str(uuid.UUID(int=rng.getrandbits(128))),
+                     "user": user,
+                     "transcript": text(rng, 60),
+                     "is_deleted": False,
+                     "created_on": now,
+                     "modified_on": now} for _ in range(args.journals)]
+        if len(journals) > 0:
+            db.Journal.insert_many(journals)
+            counts["Journal"] += len(journals)
+    return counts
+
+
+class Workload:
+    """
+    The seeded ids per user and the request each endpoint name stands for.
+    Every worker draws from its own seeded generator, so the request
+    sequence is the same from run to run.
+    """
+    def __init__(self, db, settings, users):
+        self.users = []
+        for n in range(users):
+            user = user_name(n)
+            topics = list(db.Topic.find({"user": user, "is_deleted": False}, {"id": 1, "is_multi_item": 1}))
+            topic_ids = [x["id"] for x in topics if not x.get("is_multi_item")]
+            items = [x["id"] for x in db.Extraction.find({"topic_id": {"$in": topic_ids}, "is_deleted": False},
+                                                         {"id": 1}).limit(1000)]
+            journals = [x["id"] for x in db.Journal.find({"user": user, "is_deleted": False}, {"id": 1}).limit(1000)]
+            token = jwt.encode({"sub": user,
+                                "exp": datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=6)},
+                               settings.ZAIA_SECRET_KEY, algorithm="HS256")
+            self.users.append({"user": user, "topic_ids": topic_ids, "items": items,
+                               "journals": journals, "headers": {"Authorization": f"Bearer {token}"}})
+        if len([x for x in self.users if len(x["items"]) > 0]) == 0:
+            raise SystemExit("No seeded data found, run the seed command first.")
+
+    def request(self, name, rng):
+        """:return: (method, path, params, json body, headers)"""
+        u = rng.choice([x for x in self.users if len(x["items"]) > 0])
+        user, headers = u["user"], u["headers"]
+        if name == "items":
+            return "GET", "/items/", {"user": user, "limit": 50}, None, headers
+        if name == "items_topic":
+            return "GET", "/items/", {"user": user, "topic_id": rng.choice(u["topic_ids"]), "limit": 50}, None, headers
+        if name == "items_search":
+            return "GET", "/items/", {"user": user, "search_term": rng.choice(WORDS), "limit": 50}, None, headers
+        if name == "multi_items":
+            return "GET", "/multi_items/", {"user": user, "limit": 50}, None, headers
+        if name == "topics":
+            return "GET", "/topics/", {"user": user}, None, headers
+        if name == "all_topics":
+            return "GET", "/all_topics/", None, None, headers
+        if name == "journals":
+            return "GET", "/journals/", {"user": user}, None, headers
+        if name == "update_done":
+            return "PUT", "/update_done/", None, {"id": rng.choice(u["items"]), "is_done": rng.random() < 0.5}, headers
+        if name == "mark_for_reading":
+            return "PUT", "/mark_for_reading/", None, {"id": rng.choice(u["items"]),
+                                                       "is_marked": rng.random() < 0.5}, headers
+        if name == "update_comment":
+            return "PUT", "/update_comment/", None, {"id": rng.choice(u["items"]),
+                                                     "comments": [{"text": text(rng, 5)}]}, headers
+        if name == "bulk_update_items":
+            operations = [{"id": x, "op": "done", "value": rng.random() < 0.5}
+                          for x in rng.sample(u["items"], min(20, len(u["items"])))]
+            return "POST", "/bulk_update_items/", None, {"operations": operations}, headers
+        if name == "update_journal_item":
+            return "PUT", "/update_journal_item/", None, {"id": rng.choice(u["journals"]),
+                                                          "updated_text": text(rng, 60)}, headers
+        raise ValueError(name)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def summarize(latencies_ms, errors, elapsed):
+    if len(latencies_ms) == 0:
+        return {"requests": 0, "errors": errors}
+    return {"requests": len(latencies_ms),
+            "errors": errors,
+            "throughput_rps": round(len(latencies_ms) / elapsed, 1),
+            "p50_ms": round(percentile(latencies_ms, 0.50), 2),
+            "p95_ms": round(percentile(latencies_ms, 0.95), 2),
+            "p99_ms": round(percentile(latencies_ms, 0.99), 2),
+            "max_ms": round(max(latencies_ms), 2),
+            "mean_ms": round(statistics.mean(latencies_ms), 2)}
+
+
+async def drive(workload, args):
+    mix = MIXES[args.mix]
+    names, weights = list(mix), list(mix.values())
+    latencies = {x: [] for x in names}
+    errors = {x: 0 for x in names}
+    remaining = [args.requests]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        async def worker(worker_id):
+            rng = random.Random(f"{args.seed}-{worker_id}")
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                name = rng.choices(names, weights)[0]
+                method, path, params, body, headers = workload.request(name, rng)
+                start = time.perf_counter()
+                try:
+                    response = await client.request(method, path, params=params, json=body, headers=headers)
+                    await response.aread()
+                    ok = response.status_code < 400
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies[name].append((time.perf_counter() - start) * 1000)
+                else:
+                    errors[name] += 1
+
+        for _ in range(args.warmup):
+            method, path, params, body, headers = workload.request(names[0], random.Random(args.seed))
+            await client.request(method, path, params=params, json=body, headers=headers)
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+
+    endpoints = {x: summarize(latencies[x], errors[x], elapsed) for x in names}
+    overall = summarize([x for values in latencies.values() for x in values], sum(errors.values()), elapsed)
+    return {"elapsed_sec": round(elapsed, 2), "overall": overall, "endpoints": endpoints}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before, after, threshold):
+    """
+    p95 of every endpoint after vs before.
+    :return: (report, True if some endpoint got slower than the threshold)
+    """
+    report = {}
+    regressed = False
+    for name, new in after["endpoints"].items():
+        old = before["endpoints"].get(name, {})
+        if "p95_ms" not in old or "p95_ms" not in new:
+            continue
+        ratio = round(new["p95_ms"] / old["p95_ms"], 2) if old["p95_ms"] > 0 else None
+        slower = ratio is not None and ratio > threshold
+        regressed = regressed or slower
+        report[name] = {"p95_before_ms": old["p95_ms"], "p95_after_ms": new["p95_ms"],
+                        "ratio": ratio, "regressed": slower}
+    return report, regressed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed MongoDB and load test the API")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = subparsers.add_parser("seed", help="Insert the synthetic data set")
+    seed_parser.add_argument("--users", type=int, default=10)
+    seed_parser.add_argument("--topics", type=int, default=20, help="Topics per user")
+    seed_parser.add_argument("--items", type=int, default=200, help="Items per topic")
+    seed_parser.add_argument("--journals", type=int, default=100, help="Journals per user")
+    seed_parser.add_argument("--seed", type=int, default=1)
+    seed_parser.add_argument("--reset", action="store_true", help="Remove earlier load test data first")
+
+    run_parser = subparsers.add_parser("run", help="Drive the API and report latencies")
+    run_parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    run_parser.add_argument("--users", type=int, default=10, help="Seeded users to spread requests over")
+    run_parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight")
+    run_parser.add_argument("--requests", type=int, default=5000, help="Total timed requests")
+    run_parser.add_argument("--warmup", type=int, default=50, help="Untimed requests first")
+    run_parser.add_argument("--mix", choices=sorted(MIXES), default="read")
+    run_parser.add_argument("--timeout", type=float, default=30.0)
+    run_parser.add_argument("--seed", type=int, default=1)
+    run_parser.add_argument("--output", help="Also write the results to this file")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two run results")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.add_argument("--threshold", type=float, default=1.2, help="p95 ratio counted as a regression")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.before) as f:
+            before = json.load(f)
+        with open(args.after) as f:
+            after = json.load(f)
+        report, regressed = compare(before, after, args.threshold)
+        print(json.dumps(report, indent=2))
+        sys.exit(1 if regressed else 0)
+
+    settings = Settings()
+    db = connect(settings)
+    if args.command == "seed":
+        if args.reset:
+            reset(db)
+        elif has_seeded_data(db):
+            # the ids only depend on --seed, seeding again would collide with them
+            raise SystemExit("Load test data already exists, pass --reset to replace it.")
+        start = time.perf_counter()
+        try:
+            counts = seed(db, args)
+        except (DuplicateKeyError, BulkWriteError) as e:
+            raise SystemExit(f"Seeding collided with existing documents, pass --reset: {e}")
+        print(json.dumps({"inserted": counts, "elapsed_sec": round(time.perf_counter() - start, 2)}, indent=2))
+    else:
+        workload = Workload(db, settings, args.users)
+        results = {"revision": git_revision(),
+                   "started_on": int(time.time()),
+                   "config": {k: v for k, v in vars(args).items() if k not in ("command", "output")},
+                   **asyncio.run(drive(workload, args))}
+        output = json.dumps(results, indent=2)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(output + "\n")
+        print(output)
@@ -0,0 +1,115 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    In-process LRU cache whose entries also expire after a time to live.
+    Not shared between workers, cross-worker invalidation goes through the
+    EventBus.
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # bumped by every invalidation, see set()
+        self.generation = 0
+
+    def get(self, key, default=None):
+        entry = self.data.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            if entry is not None:
+                del self.data[key]
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, ttl=None, generation=None):
+        """
+        Stores a value, evicting the least recently used entry when full.
+        :param ttl: Seconds the entry stays valid, defaults to the cache ttl.
+        :param generation: self.generation read before the value was loaded.
+            If an invalidation happened since, the value may be stale and is
+            not stored.
+        """
+        if generation is not None and generation != self.generation:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self.data[key] = (value, expires_at)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def invalidate(self, key):
+        self.generation += 1
+        self.data.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """Drops every entry whose value matches predicate(value)."""
+        self.generation += 1
+        for key in [k for k, (value, _) in self.data.items() if predicate(value)]:
+            del self.data[key]
+
+    def clear(self):
+        self.generation += 1
+        self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+
+def strong_etag(body):
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+class CachedResponse:
+    def __init__(self, body, user, topic_ids):
+        self.body = body
+        self.etag = strong_etag(body)
+        self.user = user
+        self.topic_ids = frozenset(topic_ids)
+
+
+class ResponseCache:
+    """
+    Rendered topic listings with their ETag. An entry remembers its user
+    (None for responses spanning all users) and the topics it contains, so
+    a write only drops the responses it shows up in.
+
+    Invalidations bump a generation. A response whose query started before
+    an invalidation is not stored, it may already be stale.
+    """
+    def __init__(self, maxsize, ttl):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.generation = 0
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, body, user, topic_ids, generation):
+        """
+        :param generation: self.generation read before the query ran.
+        :return: The CachedResponse, stored or not.
+        """
+        entry = CachedResponse(body, user, topic_ids)
+        if generation == self.generation:
+            self.entries.set(key, entry)
+        return entry
+
+    def invalidate_user(self, user):
+        self.generation += 1
+        self.entries.invalidate_where(lambda x: x.user is None or x.user == user)
+
+    def invalidate_topics(self, topic_ids=None):
+        """:param topic_ids: Changed topics, None when any topic may have changed."""
+        self.generation += 1
+        if topic_ids is None:
+            self.entries.clear()
+            return
+        topic_ids = set(topic_ids)
+        self.entries.invalidate_where(lambda x: not x.topic_ids.isdisjoint(topic_ids))
@@ -0,0 +1,112 @@
+import time
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from pagination import MAX_LIMIT, decode_payload, encode_cursor
+
+# Writes stamp modified_on before they commit, so a watermark taken "now"
+# could skip a write that becomes visible a moment later. The issued
+# watermark lags behind by this window and since= is inclusive: clients may
+# see a document twice, never miss one.
+SAFETY_WINDOW_SEC = 5
+
+# Soft-deleted documents are tombstones that tell clients about deletions.
+# The retention job purges them RETENTION_DAYS after the delete, so a since
+# older than that window could silently miss deletions: such a request gets
+# a 410 and the client downloads everything again with since=0.
+DAY_SEC = 86400
+
+# (response key, collection, owner field) in the order the feeds are paged.
+# Items belong to a user through their topic, everything else directly.
+CHANGE_FEEDS = [
+    ("topics", "Topic", "user"),
+    ("items", "Extraction", "topic_id"),
+    ("multi_items", "Extraction_Multi", "topic_id"),
+    ("journals", "Journal", "user"),
+]
+
+CHANGES_SORT = [("modified_on", 1), ("_id", 1)]
+
+
+class SinceExpired(Exception):
+    pass
+
+
+class ChangesPage:
+    """
+    Position in a delta sync, built from the since and cursor parameters.
+    Feeds are read one after the other in (modified_on, _id) order, the
+    cursor remembers the feed and the last document returned from it.
+    :raises SinceExpired: When since is older than the retention period.
+    """
+    def __init__(self, since=None, cursor=None, limit=None, retention_days=None):
+        if limit is None:
+            limit = MAX_LIMIT
+        if limit < 1 or limit > MAX_LIMIT:
+            raise ValueError(f"limit must be between 1 and {MAX_LIMIT}")
+        self.limit = limit
+        if cursor is not None:
+            payload = decode_changes_cursor(cursor)
+            self.since = payload["s"]
+            self.watermark = payload["w"]
+            self.feed = payload["f"]
+            self.after = (payload["m"], ObjectId(payload["i"])) if payload.get("i") else None
+        else:
+            self.since = since or 0
+            self.watermark = time.time() - SAFETY_WINDOW_SEC
+            self.feed = 0
+            self.after = None
+        if retention_days is not None and 0 < self.since < time.time() - retention_days * DAY_SEC:
+            raise SinceExpired(self.since)
+
+    @property
+    def done(self):
+        return self.feed >= len(CHANGE_FEEDS)
+
+    def query(self, owner_query):
+        """Filter of the current feed: the owner's documents changed since the watermark."""
+        query = {**owner_query, "modified_on": {"$gte": self.since}}
+        if self.after is not None:
+            modified_on, last_id = self.after
+            query["$or"] = [{"modified_on": {"$gt": modified_on}},
+                            {"modified_on": modified_on, "_id": {"$gt": last_id}}]
+        return query
+
+    def advance(self, docs, requested):
+        """
+        Moves past the documents read from the current feed.
+        :param docs: Documents fetched with a limit of requested + 1.
+        :param requested: Number of documents the page still had room for.
+        :return: The documents that belong to this page.
+        """
+        if len(docs) > requested:
+            docs = docs[:requested]
+            self.after = (docs[-1]["modified_on"], docs[-1]["_id"])
+        else:
+            self.feed += 1
+            self.after = None
+        return docs
+
+    def next_cursor(self):
+        if self.done:
+            return None
+        payload = {"s": self.since, "w": self.watermark, "f": self.feed}
+        if self.after is not None:
+            payload["m"], payload["i"] = self.after[0], str(self.after[1])
+        return encode_cursor(payload)
+
+
+def decode_changes_cursor(cursor):
+    try:
+        payload = decode_payload(cursor)
+        float(payload["s"])
+        float(payload["w"])
+        if not 0 <= int(payload["f"]) < len(CHANGE_FEEDS):
+            raise ValueError
+        if payload.get("i") is not None:
+            ObjectId(payload["i"])
+            payload["m"]
+        return payload
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise ValueError("invalid cursor")
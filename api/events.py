@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from collections import deque
+import os
+import time
+import uuid
+
+from pymongo.errors import PyMongoError
+
+EVENTS_COLLECTION = "Events"
+EVENTS_COLLECTION_SIZE = 16 * 1024 * 1024
+RECONNECT_DELAY_SEC = 1
+# ObjectIds and ts come from the clock of each publishing worker, so events
+# are not ordered by either across workers. A reopened cursor replays the
+# events stamped up to this long before the newest one seen, in insertion
+# order, and skips those already handled.
+RESUME_WINDOW_SEC = 30
+SEEN_EVENTS = 10000
+
+TOPICS_CHANGED = "topics_changed"
+TOPIC_COUNTS_CHANGED = "topic_counts_changed"
+
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class EventBus:
+    """
+    Publish/subscribe between API workers over a capped MongoDB collection.
+    Subscribers follow the collection with a tailable cursor, so events are
+    pushed as soon as they are written without polling.
+    """
+    def __init__(self, data_manager):
+        self.data_manager = data_manager
+        self.logger = logging.getLogger('Zaia')
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    async def setup(self):
+        created = await self.data_manager.createCappedCollection(EVENTS_COLLECTION, EVENTS_COLLECTION_SIZE)
+        if created:
+            # a tailable cursor on an empty capped collection dies immediately
+            await self.publish("bus_created")
+
+    async def publish(self, kind, **payload):
+        await self.data_manager.insertDocuments(collection_name=EVENTS_COLLECTION,
+                                                documents={"kind": kind,
+                                                           "payload": payload,
+                                                           "origin": self.origin,
+                                                           "ts": time.time()})
+
+    async def listen(self, handler):
+        """
+        Calls handler(event) for every event published after the call, forever,
+        plus the events of the last RESUME_WINDOW_SEC before it; handlers must
+        not mind seeing an event they could have missed. Reconnects after
+        errors and resumes without losing events or handling one twice.
+        """
+        resume_ts = time.time()
+        seen = set()
+        seen_order = deque()
+        while True:
+            try:
+                query = {"ts": {"$gte": resume_ts - RESUME_WINDOW_SEC}}
+                async for event in self.data_manager.tailDocuments(EVENTS_COLLECTION, query=query):
+                    if event["_id"] in seen:
+                        continue
+                    seen.add(event["_id"])
+                    seen_order.append(event["_id"])
+                    if len(seen_order) > SEEN_EVENTS:
+                        seen.discard(seen_order.popleft())
+                    resume_ts = max(resume_ts, event.get("ts", 0))
+                    try:
+                        await handler(event)
+                    except Exception as e:
+                        self.logger.error(f"Event handler failed for {event.get('kind')}: {e}")
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError as e:
+                self.logger.error(f"Event bus connection lost: {e}")
+            await asyncio.sleep(RECONNECT_DELAY_SEC)
+
+
+class EventFanout:
+    """
+    Hands the events received by this worker to local subscribers, e.g. the
+    open server-sent event streams. A subscriber that does not keep up loses
+    events instead of slowing down the others.
+    """
+    def __init__(self):
+        self.subscribers = set()
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    def publish(self, event):
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                pass
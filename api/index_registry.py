@@ -0,0 +1,123 @@
+import re
+
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+
+from search import TOKENS_FIELD
+
+NOT_DELETED = {"is_deleted": False}
+# Until migrate-is-deleted has backfilled is_deleted, documents may lack the
+# field and only this filter finds them; it cannot use the partial indexes.
+LEGACY_NOT_DELETED = {"is_deleted": {"$ne": True}}
+# Collections with soft deletes, every document carries is_deleted
+SOFT_DELETE_COLLECTIONS = ["Extraction", "Extraction_Multi", "Topic", "Journal"]
+
+# Indexes that back the access paths used by MainApp. Every index is named so
+# that re-applying the registry at startup is a no-op once it exists.
+# Listings only read live documents, their indexes are partial on NOT_DELETED.
+INDEXES = {
+    "Extraction": [
+        IndexModel([("audio_name", ASCENDING)], name="audio_name_unique", unique=True,
+                   partialFilterExpression={"audio_name": {"$exists": True}}),
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True,
+                   partialFilterExpression={"id": {"$exists": True}}),
+        IndexModel([("topic_id", ASCENDING), ("created_on", DESCENDING), ("_id", DESCENDING)],
+                   name="live_topic_id_created_on", partialFilterExpression=NOT_DELETED),
+        IndexModel([("title", TEXT), ("value", TEXT)], name="text_search",
+                   weights={"title": 3, "value": 1}, default_language="english"),
+        IndexModel([(TOKENS_FIELD, ASCENDING)], name="search_tokens"),
+        IndexModel([("topic_id", ASCENDING), ("modified_on", ASCENDING), ("_id", ASCENDING)],
+                   name="topic_id_modified_on"),
+    ],
+    "Extraction_Multi": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True,
+                   partialFilterExpression={"id": {"$exists": True}}),
+        IndexModel([("topic_id", ASCENDING), ("created_on", DESCENDING), ("_id", DESCENDING)],
+                   name="live_topic_id_created_on", partialFilterExpression=NOT_DELETED),
+        IndexModel([("title", TEXT), ("items.value", TEXT)], name="text_search",
+                   weights={"title": 3, "items.value": 1}, default_language="english"),
+        IndexModel([(TOKENS_FIELD, ASCENDING)], name="search_tokens"),
+        IndexModel([("topic_id", ASCENDING), ("modified_on", ASCENDING), ("_id", ASCENDING)],
+                   name="topic_id_modified_on"),
+    ],
+    "Topic": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True,
+                   partialFilterExpression={"id": {"$exists": True}}),
+        IndexModel([("user", ASCENDING), ("topic_type", ASCENDING)], name="live_user_topic_type",
+                   partialFilterExpression=NOT_DELETED),
+        IndexModel([("user", ASCENDING), ("modified_on", ASCENDING), ("_id", ASCENDING)],
+                   name="user_modified_on"),
+    ],
+    "User": [
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+    ],
+    "RefreshToken": [
+        IndexModel([("refresh_token", ASCENDING)], name="refresh_token_unique", unique=True),
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+        IndexModel([("expires_on", ASCENDING)], name="expires_on"),
+    ],
+    "TranscriptionJob": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+        IndexModel([("status", ASCENDING), ("heartbeat_on", ASCENDING)], name="status_heartbeat_on"),
+    ],
+    "Journal": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True,
+                   partialFilterExpression={"id": {"$exists": True}}),
+        IndexModel([("user", ASCENDING), ("created_on", DESCENDING)], name="live_user_created_on",
+                   partialFilterExpression=NOT_DELETED),
+        IndexModel([("user", ASCENDING), ("modified_on", ASCENDING), ("_id", ASCENDING)],
+                   name="user_modified_on"),
+    ],
+}
+
+# Full indexes replaced by the partial ones above, dropped once every
+# document has is_deleted (manage.py migrate-is-deleted).
+OBSOLETE_INDEXES = [
+    ("Extraction", "topic_id_created_on"),
+    ("Extraction_Multi", "topic_id_created_on"),
+    ("Topic", "user_topic_type"),
+    ("Journal", "user_created_on"),
+]
+
+# Representative query shapes issued by MainApp, used by the explain report.
+# Values are placeholders, only the shape matters for plan selection.
+QUERY_SHAPES = [
+    ("get_items by topic", "Extraction", {**NOT_DELETED, "topic_id": "sample"}),
+    ("get_items by user topics", "Extraction", {**NOT_DELETED, "topic_id": {"$in": ["sample", "sample2"]}}),
+    ("update item by audio_name", "Extraction", {"audio_name": "sample.mp3"}),
+    ("search items", "Extraction", {**NOT_DELETED, "$text": {"$search": "sample"}}),
+    ("prefix search items", "Extraction", {**NOT_DELETED, TOKENS_FIELD: {"$all": [re.compile("^sam")]}}),
+    ("get_multi_items by topic", "Extraction_Multi", {**NOT_DELETED, "topic_id": "sample"}),
+    ("delete multi item by id", "Extraction_Multi", {"id": "sample"}),
+    ("topics by user", "Topic", {**NOT_DELETED, "user": "sample"}),
+    ("topics by user and type", "Topic", {**NOT_DELETED, "user": "sample", "topic_type": "news"}),
+    ("update topic by id", "Topic", {"id": "sample"}),
+    ("get_user", "User", {"username": "sample"}),
+    ("validate_refresh_token", "RefreshToken", {"refresh_token": "sample"}),
+    ("get_journals", "Journal", {**NOT_DELETED, "user": "sample"}),
+    ("update journal by id", "Journal", {"id": "sample"}),
+    ("transcription job status", "TranscriptionJob", {"id": "sample"}),
+    ("changes of topics", "Topic", {"user": "sample", "modified_on": {"$gte": 0}}),
+    ("changes of items", "Extraction", {"topic_id": {"$in": ["sample", "sample2"]}, "modified_on": {"$gte": 0}}),
+    ("changes of multi items", "Extraction_Multi", {"topic_id": {"$in": ["sample"]}, "modified_on": {"$gte": 0}}),
+    ("changes of journals", "Journal", {"user": "sample", "modified_on": {"$gte": 0}}),
+]
+
+
+def find_stages(plan, stage_name):
+    """
+    Walks an explain() plan tree and returns every stage with the given name.
+    :param plan: dict (or list) from the explain output.
+    :param stage_name: Stage to look for, e.g. COLLSCAN.
+    :return: List of matching stage dicts.
+    """
+    found = []
+    if isinstance(plan, dict):
+        if plan.get("stage") == stage_name:
+            found.append(plan)
+        for value in plan.values():
+            found.extend(find_stages(value, stage_name))
+    elif isinstance(plan, list):
+        for value in plan:
+            found.extend(find_stages(value, stage_name))
+    return found
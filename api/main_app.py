@@ -1,33 +1,56 @@
 
-from MongoDBLayer import  MongoDBLayer
-
-import os
+from AsyncMongoDBLayer import AsyncMongoDBLayer
+from index_registry import INDEXES, LEGACY_NOT_DELETED, NOT_DELETED, OBSOLETE_INDEXES, QUERY_SHAPES, SOFT_DELETE_COLLECTIONS, find_stages
+from search import TOKENS_FIELD, has_text_search, tokenize
+from pagination import Page
+from changes import CHANGE_FEEDS, CHANGES_SORT
+from caches import ResponseCache, TTLCache
+from events import TOPIC_COUNTS_CHANGED, TOPICS_CHANGED, EventBus, EventFanout
+from audio_store import S3AudioStore
+from transcription import TranscriptionQueue
+from retention import RetentionJob, expires_at
+
+import asyncio
 import secrets
 import hashlib
 import logging
-import math
 import time
-import json
 from pathlib import Path
 import datetime
 from datetime import  timedelta
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 from passlib.context import CryptContext
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, PyMongoError
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
 from jose import  jwt
-from deepgram import (
-    DeepgramClient,
-    PrerecordedOptions,
-    FileSource,
-)
 
 REFRESH_TOKEN_EXPIRE_DAYS_IN_SEC = 7*86400
-SHARED_DIR = "/data"
-SHARED_FILE = "shared.json"
+MIGRATIONS_COLLECTION = "Migration"
+MIGRATION_CHECK_SEC = 60
 load_dotenv()
 
+TOPIC_COUNTERS = ["total_items", "done_items", "total_multi_items"]
+COUNTER_PROJECTION = {"topic_id": 1, "done": 1, "is_deleted": 1}
+# item fields the topic counters depend on
+COUNTER_FIELDS = {"done", "is_deleted"}
+COUNTED_SET_ATTEMPTS = 3
+ITEM_KEY_PROJECTION = {"audio_name": 1, "id": 1}
+# tokens of the last guarded writes kept on an item, read back to learn
+# which writes of an unordered bulk_write applied
+RECENT_OPS_FIELD = "recent_ops"
+RECENT_OPS = 16
+MAX_BULK_OPERATIONS = 1000
+# op -> (collection, field it sets, type of the value or None when always True)
+BULK_OPS = {"done": ("Extraction", "done", bool),
+            "marked": ("Extraction", "is_marked", bool),
+            "comment": ("Extraction", "comments", list),
+            "delete": ("Extraction", "is_deleted", None),
+            "delete_multi": ("Extraction_Multi", "is_deleted", None)}
+
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -50,6 +73,16 @@ class Settings(BaseSettings):
     ZAIA_SECRET_KEY: str = read_docker_secret("ZAIA_SECRET_KEY")
     DEEPGRAM_API_KEY: str = read_docker_secret("DEEPGRAM_API_KEY")
     LOGIN_CODE: str = read_docker_secret("LOGIN_CODE")
+    # account the web extractor logs in with, the only one sent every user's topic events
+    ZAIA_API_USER: str = read_docker_secret("ZAIA_API_USER") or ""
+    TOPIC_CACHE_SIZE: int = 10000
+    TOPIC_CACHE_TTL_SEC: int = 300
+    TOKEN_CACHE_SIZE: int = 10000
+    PASSWORD_HASH_WORKERS: int = 2
+    AUDIO_CACHE_MAX_BYTES: int = 2 * 1024 * 1024 * 1024
+    TRANSCRIPTION_WORKERS: int = 4
+    TRANSCRIPTION_QUEUE_SIZE: int = 100
+    RETENTION_DAYS: int = 30
 
     class Config:
         env_file = ".env" 
@@ -61,8 +94,22 @@ class MainApp:
         self.settings = Settings()
         self.create_data_manager()
         self.algorithm = "HS256"
-        
-        os.makedirs(SHARED_DIR, exist_ok=True)
+        self.topic_ids_cache = TTLCache(maxsize=self.settings.TOPIC_CACHE_SIZE, ttl=self.settings.TOPIC_CACHE_TTL_SEC)
+        self.topic_responses = ResponseCache(maxsize=self.settings.TOPIC_CACHE_SIZE, ttl=self.settings.TOPIC_CACHE_TTL_SEC)
+        self.events = EventBus(self.data_manager)
+        self.topic_subscribers = EventFanout()
+        # live documents filter, strict once the is_deleted backfill is done
+        self.live_query = LEGACY_NOT_DELETED
+        self.audio_store = S3AudioStore(self.settings)
+        self.background_tasks = []
+        self.token_cache = TTLCache(maxsize=self.settings.TOKEN_CACHE_SIZE, ttl=ACCESS_TOKEN_EXPIRE_MINUTES*60)
+        self.password_executor = ThreadPoolExecutor(max_workers=self.settings.PASSWORD_HASH_WORKERS,
+                                                    thread_name_prefix="password_hash")
+        self.transcriptions = TranscriptionQueue(self.data_manager,
+                                                 api_key=self.settings.DEEPGRAM_API_KEY,
+                                                 on_transcript=self.insert_journal,
+                                                 workers=self.settings.TRANSCRIPTION_WORKERS,
+                                                 max_queued=self.settings.TRANSCRIPTION_QUEUE_SIZE)
 
     def setLogger(self):
         log = logging.getLogger('Zaia')
@@ -86,206 +133,636 @@ class MainApp:
             self.logger.info('here')
             uri = self.settings.MONGO_URL
             db_name = self.settings.DB_NAME
-            self.data_manager = MongoDBLayer(uri, db_name)
+            self.data_manager = AsyncMongoDBLayer(uri, db_name)
             self.logger.info('here1')
         except Exception as e:
             self.logger.error(f"Connection failed: {e}")
     
-    def closeConnection(self):
-        self.data_manager.close_connection()
-
-    def sanitize_data(self, data):
-        for record in data:
-            for key, value in record.items():
-                if isinstance(value, float):
-                    if math.isnan(value) or math.isinf(value):
-                        record[key] = None  # Or set to a default value
-        return data
-   
-    def get_items(self, user, search_term, topic_id, is_marked, only_with_comments):
-        if user == '':
-            return []
-        filter_params = {"$or": [
-        {"is_deleted": False},
-        {"is_deleted": {"$exists": False}}
-        ]}
+    async def closeConnection(self):
+        await self.data_manager.close_connection()
+        self.password_executor.shutdown(wait=False)
+
+    async def start_background_tasks(self):
+        try:
+            await self.events.setup()
+        except ConnectionFailure as e:
+            self.logger.error(f"Cannot set up the event bus, MongoDB unreachable: {e}")
+        self.background_tasks.append(asyncio.create_task(self.events.listen(self.handle_event)))
+        if not self.settings.ZAIA_API_USER:
+            self.logger.error("ZAIA_API_USER is not set: /topic_events/ sends every stream only its own user's "
+                              "events, the web extractor will miss the topic changes of all other users")
+        self.background_tasks.append(asyncio.create_task(self.watch_is_deleted_migration()))
+        self.background_tasks.extend(self.transcriptions.start())
+
+    async def refresh_live_query(self):
+        """
+        Switches reads to the strict NOT_DELETED filter once the Migration
+        records show every soft-delete collection backfilled.
+        :return: True when the strict filter is in use.
+        """
+        migrations = await self.data_manager.searchDocument(MIGRATIONS_COLLECTION,
+                                                            {"name": "is_deleted", "done": True})
+        done = {x.get("collection") for x in migrations}
+        if all(x in done for x in SOFT_DELETE_COLLECTIONS):
+            self.live_query = NOT_DELETED
+        return self.live_query is NOT_DELETED
+
+    async def watch_is_deleted_migration(self):
+        """The migration runs from manage.py, workers notice its end within a minute."""
+        while True:
+            try:
+                if await self.refresh_live_query():
+                    self.logger.info("is_deleted backfill done, reading with the strict filter")
+                    return
+            except PyMongoError as e:
+                self.logger.error(f"Cannot read the migration state: {e}")
+            await asyncio.sleep(MIGRATION_CHECK_SEC)
+
+    async def stop_background_tasks(self):
+        for task in self.background_tasks:
+            task.cancel()
+        await asyncio.gather(*self.background_tasks, return_exceptions=True)
+        self.background_tasks = []
+
+    async def handle_event(self, event):
+        """Applies events published by any worker to this worker's caches and subscribers."""
+        if event["kind"] == TOPICS_CHANGED:
+            self.topic_ids_cache.invalidate(event["payload"].get("user"))
+            self.topic_responses.invalidate_user(event["payload"].get("user"))
+            self.topic_subscribers.publish({"kind": event["kind"], "ts": event["ts"], **event["payload"]})
+        elif event["kind"] == TOPIC_COUNTS_CHANGED:
+            self.topic_responses.invalidate_topics(event["payload"].get("topic_ids"))
+
+    async def topics_changed(self, user, extract=False):
+        """
+        Tells every worker that a user's topics changed.
+        :param extract: The change needs a new extraction run, e.g. a new or edited topic.
+        """
+        self.topic_ids_cache.invalidate(user)
+        self.topic_responses.invalidate_user(user)
+        await self.events.publish(TOPICS_CHANGED, user=user, extract=extract)
+
+    async def topic_counts_changed(self, topic_ids=None):
+        """
+        Tells every worker that item counters changed, the topic listings showing them are stale.
+        :param topic_ids: Changed topics, None for all.
+        """
+        self.topic_responses.invalidate_topics(topic_ids)
+        await self.events.publish(TOPIC_COUNTS_CHANGED, topic_ids=topic_ids)
+
+    async def ensure_indexes(self):
+        """Applies the index registry. Safe to run on every startup."""
+        for collection_name, indexes in INDEXES.items():
+            for index in indexes:
+                try:
+                    await self.data_manager.createIndexes(collection_name, [index])
+                except ConnectionFailure as e:
+                    self.logger.error(f"Cannot create indexes, MongoDB unreachable: {e}")
+                    return
+                except Exception as e:
+                    self.logger.error(f"Index {index.document['name']} on {collection_name} failed: {e}")
+
+    async def explain_query_shapes(self):
+        """Runs explain() for every registered MainApp query shape and flags collection scans."""
+        report = []
+        for name, collection_name, query in QUERY_SHAPES:
+            explain = await self.data_manager.explainQuery(collection_name, query)
+            winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+            report.append({"name": name,
+                           "collection": collection_name,
+                           "collscan": len(find_stages(winning_plan, "COLLSCAN")) > 0,
+                           "indexes": [x.get("indexName") for x in find_stages(winning_plan, "IXSCAN")]})
+        return report
+
+    async def items_filter(self, user, topic_id, is_marked, only_with_comments=None):
+        filter_params = dict(self.live_query)
         if topic_id is not None:
             filter_params["topic_id"] = topic_id
         else:
-            topics = self.get_topics_without_items(user=user, topic_type="")
-            topics_ids = [x['id'] for x in topics ]
-            filter_params["topic_id"] = {"$in": topics_ids}
+            filter_params["topic_id"] = {"$in": await self.get_user_topic_ids(user)}
         if is_marked is not None:
             filter_params["is_marked"] = is_marked
         if only_with_comments:
             filter_params['comments'] =  {"$ne": []}
-        data = self.data_manager.searchText("Extraction", filter_params , "value", search_term)
-        
-        result = []
-        for doc in data:
-            doc["_id"] = str(doc["_id"])  
-            result.append(doc)
+        return filter_params
+
+    async def search_page(self, collection_name, filter_params, search_term, page):
+        data = await self.data_manager.searchText(collection_name = collection_name,
+                                                  filter_query = page.apply(filter_params),
+                                                  search_text = search_term,
+                                                  fields = page.fields,
+                                                  sort = page.sort_spec(),
+                                                  skip = page.offset,
+                                                  limit = page.fetch_limit())
+        return page.next_cursor(data)
+
+    async def stream_search_page(self, collection_name, filter_params, search_term, page):
+        """
+        Yields the documents of a page one at a time, straight from the cursor.
+        When the page has a limit and more documents match, the last
+        yielded record is {"next_cursor": ...} instead of a document.
+        """
+        count = 0
+        async for doc in self.data_manager.iterText(collection_name = collection_name,
+                                                    filter_query = page.apply(filter_params),
+                                                    search_text = search_term,
+                                                    fields = page.fields,
+                                                    sort = page.sort_spec(),
+                                                    skip = page.offset,
+                                                    limit = page.fetch_limit()):
+            if page.limit is not None and count == page.limit:
+                yield {"next_cursor": page.cursor_after(last)}
+                return
+            last = doc
+            count += 1
+            yield last
+   
+    async def get_items(self, user, search_term, topic_id, is_marked, only_with_comments, page=None):
+        page = page or Page(has_text_search=has_text_search(search_term))
+        if user == '':
+            return [], None
+        filter_params = await self.items_filter(user, topic_id, is_marked, only_with_comments)
+        return await self.search_page("Extraction", filter_params, search_term, page)
 
-        result = self.sanitize_data(result)
-        return result
+    async def stream_items(self, user, search_term, topic_id, is_marked, only_with_comments, page=None):
+        page = page or Page(has_text_search=has_text_search(search_term))
+        if user == '':
+            return
+        filter_params = await self.items_filter(user, topic_id, is_marked, only_with_comments)
+        async for doc in self.stream_search_page("Extraction", filter_params, search_term, page):
+            yield doc
     
-    def get_multi_items(self, user, search_term, topic_id, is_marked):
+    async def get_multi_items(self, user, search_term, topic_id, is_marked, page=None):
+        page = page or Page(has_text_search=has_text_search(search_term))
         if user == '':
-            return []
-        filter_params = {"$or": [
-        {"is_deleted": False},
-        {"is_deleted": {"$exists": False}}
-        ]}
-        if topic_id is not None:
-            filter_params["topic_id"] = topic_id
-        if is_marked is not None:
-            filter_params["is_marked"] = is_marked
-        data = self.data_manager.searchText(collection_name = "Extraction_Multi", 
-                                            filter_query = filter_params , 
-                                           text_field = "items.value", 
-                                           search_text = search_term)
-        
-        result = []
-        for doc in data:
-            doc["_id"] = str(doc["_id"]) 
-            result.append(doc)
-      
-        if topic_id is None:
-            topics = self.get_topics_without_items(user=user, topic_type="")
-            topics_ids = [x['id'] for x in topics ]
-        
-            result = [x for x in result if x['topic_id'] in topics_ids]
+            return [], None
+        filter_params = await self.items_filter(user, topic_id, is_marked)
+        return await self.search_page("Extraction_Multi", filter_params, search_term, page)
 
-  
-        result = self.sanitize_data(result)
-        return result
-    
-    def get_journals(self, user):
+    async def stream_multi_items(self, user, search_term, topic_id, is_marked, page=None):
+        page = page or Page(has_text_search=has_text_search(search_term))
         if user == '':
-            return []
-        filter_params = {"$or": [
-        {"is_deleted": False},
-        {"is_deleted": {"$exists": False}}
-        ]}
-        filter_params['user'] = user
-        data = self.data_manager.searchDocument(collection_name = "Journal", 
-                                    query = filter_params)
-        
-        result = []
-        for doc in data:
-            doc["_id"] = str(doc["_id"]) 
-            result.append(doc)
-        
-        return result
+            return
+        filter_params = await self.items_filter(user, topic_id, is_marked)
+        async for doc in self.stream_search_page("Extraction_Multi", filter_params, search_term, page):
+            yield doc
 
-    def update_comment(self, id: str, comments): 
-        self.data_manager.updateDocument(collection_name="Extraction", 
-                                         query={"audio_name": id+".mp3"}, 
-                                         update={"comments": comments, 
-                                                   "modified_on": int(time.time())})
+    def journals_filter(self, user):
+        filter_params = dict(self.live_query)
+        filter_params['user'] = user
+        return filter_params
     
-    def update_done(self, id: str, is_done: bool): 
-        self.data_manager.updateDocument(collection_name="Extraction", 
-                                        query= {"audio_name": id+".mp3"}, 
-                                        update={"done": is_done, "modified_on": int(time.time())})
+    async def get_journals(self, user):
+        if user == '':
+            return []
+        return await self.data_manager.searchDocument(collection_name = "Journal", 
+                                    query = self.journals_filter(user))
 
-    def update_marked(self, id: str, is_marked: bool): 
-        self.data_manager.updateDocument(collection_name="Extraction", 
-                                         query={"audio_name": id+".mp3"}, 
-                                         update={"is_marked": is_marked, "modified_on": int(time.time())})
+    async def stream_journals(self, user):
+        if user == '':
+            return
+        async for doc in self.data_manager.iterDocuments(collection_name = "Journal",
+                                                         query = self.journals_filter(user)):
+            yield doc
 
-   
+    async def update_comment(self, id: str, comments): 
+        await self.bulk_update_items([{"id": id, "op": "comment", "value": comments}])
     
-    def get_topics_without_items(self, topic_type: str = "", user = ""):
+    async def update_done(self, id: str, is_done: bool): 
+        await self.bulk_update_items([{"id": id, "op": "done", "value": is_done}])
+
+    async def update_marked(self, id: str, is_marked: bool): 
+        await self.bulk_update_items([{"id": id, "op": "marked", "value": is_marked}])
+
+    async def bulk_update_items(self, operations):
+        """
+        Applies per-id item operations with one unordered bulk_write per
+        collection and one for the topic counters. Writes on done or
+        is_deleted only match while the item is in the state their counter
+        delta was computed from, and are stamped with an op token; one read
+        of the tokens tells which of them applied, only those are counted
+        and the others are retried on the state they lost to.
+        :param operations: list of {"id", "op", "value"} dicts, op is a key of BULK_OPS.
+        :return: list of {"id", "op", "status"} in the order of operations, status is
+                 updated, not_found, invalid or error (with an error message).
+        """
+        if len(operations) > MAX_BULK_OPERATIONS:
+            raise ValueError(f"At most {MAX_BULK_OPERATIONS} operations per request")
+        results = [{"id": x.get("id"), "op": x.get("op"), "status": "updated"} for x in operations]
+        now = int(time.time())
+        counters = {}
+        for collection_name in ("Extraction", "Extraction_Multi"):
+            indexes = []
+            for i, operation in enumerate(operations):
+                spec = BULK_OPS.get(operation.get("op"))
+                if spec is None or (spec[2] is not None and not isinstance(operation.get("value"), spec[2])):
+                    results[i]["status"] = "invalid"
+                elif spec[0] == collection_name:
+                    indexes.append(i)
+            if len(indexes) == 0:
+                continue
+            states = await self.item_states(collection_name, [operations[i]["id"] for i in indexes])
+            # all operations on one id are merged into a single $set, so their
+            # order does not depend on how the server runs an unordered batch
+            updates = {}
+            for i in indexes:
+                id = operations[i]["id"]
+                if id not in states:
+                    results[i]["status"] = "not_found"
+                    continue
+                _, field, value_type = BULK_OPS[operations[i]["op"]]
+                value = operations[i]["value"] if value_type is not None else True
+                updates.setdefault(id, {"modified_on": now})[field] = value
+            errors, deltas = await self.guarded_bulk_set(collection_name, updates, states)
+            for topic_id, delta in deltas:
+                topic_counters = counters.setdefault(topic_id, {})
+                for counter, change in delta.items():
+                    topic_counters[counter] = topic_counters.get(counter, 0) + change
+            for i in indexes:
+                id = operations[i]["id"]
+                if id in errors:
+                    results[i]["status"] = "error"
+                    results[i]["error"] = errors[id]
+        await self.increment_topics_counters(counters)
+        return results
+
+    def items_query(self, collection_name, ids):
+        if collection_name == "Extraction":
+            return {"audio_name": {"$in": [id+".mp3" for id in ids]}}
+        return {"id": {"$in": ids}}
+
+    def item_id(self, collection_name, doc):
+        return doc["audio_name"][:-len(".mp3")] if collection_name == "Extraction" else doc["id"]
+
+    def item_key(self, collection_name, id):
+        return {"audio_name": id+".mp3"} if collection_name == "Extraction" else {"id": id}
+
+    async def item_states(self, collection_name, ids):
+        """Current counter relevant fields of the items, by id."""
+        states = {}
+        async for doc in self.data_manager.iterDocuments(collection_name,
+                                                         query=self.items_query(collection_name, ids),
+                                                         projection={**COUNTER_PROJECTION, **ITEM_KEY_PROJECTION}):
+            states[self.item_id(collection_name, doc)] = doc
+        return states
+
+    def counter_guard(self, state):
+        """Matches the item only while its counter relevant fields are as in state."""
+        return {field: True if state.get(field, False) else {"$ne": True} for field in COUNTER_FIELDS}
+
+    def fields_delta(self, collection_name, state, fields):
+        """Topic counter changes caused by setting fields on an item in state."""
+        delta = {}
+        current = dict(state)
+        for field, value in fields.items():
+            for counter, change in self.counter_delta(collection_name, current, field, value).items():
+                delta[counter] = delta.get(counter, 0) + change
+            current[field] = value
+        return delta
+
+    def counter_delta(self, collection_name, state, field, value):
+        """Topic counter changes caused by setting field to value on an item in state."""
+        if state.get('is_deleted', False):
+            return {}
+        if collection_name == "Extraction_Multi":
+            return {"total_multi_items": -1} if field == "is_deleted" else {}
+        if field == "is_deleted":
+            return {"total_items": -1, "done_items": -1} if state.get('done', False) else {"total_items": -1}
+        if field == "done" and state.get('done', False) != value:
+            return {"done_items": 1 if value else -1}
+        return {}
+
+    async def guarded_bulk_set(self, collection_name, updates, states):
+        """
+        Sets fields on many items in one unordered bulk_write per attempt.
+        Writes that move a counter match only while the item is as in states
+        and push a token to the item's recent_ops, so reading the tokens back
+        shows which writes applied. A token list rather than a single field
+        keeps the proof when another write lands before the read.
+        :param updates: dict of item id -> fields to $set.
+        :param states: dict of item id -> state read with item_states.
+        :return: (dict of item id -> error message, list of (topic id, delta) of applied writes)
+        """
+        errors = {}
+        deltas = []
+        pending = updates
+        for _ in range(COUNTED_SET_ATTEMPTS):
+            if len(pending) == 0:
+                break
+            ids = list(pending.keys())
+            tokens = {}
+            operations = []
+            for id in ids:
+                query = self.item_key(collection_name, id)
+                update = {"$set": pending[id]}
+                if COUNTER_FIELDS.intersection(pending[id]):
+                    tokens[id] = uuid.uuid4().hex
+                    query.update(self.counter_guard(states[id]))
+                    update["$push"] = {RECENT_OPS_FIELD: {"$each": [tokens[id]], "$slice": -RECENT_OPS}}
+                operations.append(UpdateOne(query, update))
+            try:
+                await self.data_manager.bulkWrite(collection_name, operations)
+            except BulkWriteError as e:
+                for x in e.details.get("writeErrors", []):
+                    errors[ids[x["index"]]] = x.get("errmsg", "")
+            tokens = {id: token for id, token in tokens.items() if id not in errors}
+            if len(tokens) == 0:
+                pending = {}
+                break
+            applied = set()
+            async for doc in self.data_manager.iterDocuments(collection_name,
+                                                             query={**self.items_query(collection_name, list(tokens)),
+                                                                    RECENT_OPS_FIELD: {"$in": list(tokens.values())}},
+                                                             projection=ITEM_KEY_PROJECTION):
+                applied.add(self.item_id(collection_name, doc))
+            for id in applied:
+                deltas.append((states[id]["topic_id"], self.fields_delta(collection_name, states[id], pending[id])))
+            lost = [id for id in tokens if id not in applied]
+            states = await self.item_states(collection_name, lost) if len(lost) > 0 else {}
+            for id in lost:
+                if id not in states:
+                    errors[id] = "item not found"
+            pending = {id: pending[id] for id in lost if id in states}
+        for id in pending:
+            errors[id] = "item changed concurrently"
+        return errors, deltas
+
+    async def get_user_topic_ids(self, user):
+        """Ids of the user's live topics, cached until a topic of the user changes."""
+        topics_ids = self.topic_ids_cache.get(user)
+        if topics_ids is None:
+            # a topic change during the read must not leave the old list cached
+            generation = self.topic_ids_cache.generation
+            topics = await self.get_topics_without_items(user=user, topic_type="")
+            topics_ids = [x['id'] for x in topics ]
+            self.topic_ids_cache.set(user, topics_ids, generation=generation)
+        return topics_ids
+
+    async def all_user_topic_ids(self, user):
+        """Ids of all of the user's topics, deleted ones included."""
+        topics = await self.data_manager.findBatch(collection_name="Topic",
+                                                   query={"user": user},
+                                                   projection={"id": 1})
+        return [x['id'] for x in topics if 'id' in x]
+
+    async def get_changes(self, user, page):
+        """
+        Documents of the user created, updated or soft-deleted since the
+        page's watermark, across topics, items, multi items and journals.
+        :param page: ChangesPage.
+        :return: dict with a list per feed, the new watermark and the next cursor
+                 (None once every feed is exhausted).
+        """
+        result = {name: [] for name, _, _ in CHANGE_FEEDS}
+        remaining = page.limit
+        topic_ids = None
+        while not page.done and remaining > 0:
+            name, collection_name, owner = CHANGE_FEEDS[page.feed]
+            if owner == "topic_id":
+                if topic_ids is None:
+                    topic_ids = await self.all_user_topic_ids(user)
+                owner_query = {"topic_id": {"$in": topic_ids}}
+            else:
+                owner_query = {"user": user}
+            docs = await self.data_manager.findBatch(collection_name=collection_name,
+                                                     query=page.query(owner_query),
+                                                     sort=CHANGES_SORT,
+                                                     limit=remaining + 1)
+            docs = page.advance(docs, remaining)
+            if collection_name == "Topic":
+                docs = [self.topic_with_counts(x) for x in docs]
+            result[name].extend(docs)
+            remaining -= len(docs)
+        result["watermark"] = page.watermark
+        result["next_cursor"] = page.next_cursor()
+        return result
+
+    async def get_topics_without_items(self, topic_type: str = "", user = ""):
         if user == '':
             return []
-        params = {"$or": [
-        {"is_deleted": False},
-        {"is_deleted": {"$exists": False}}
-        ]}
+        params = dict(self.live_query)
         if topic_type != "":
             params["topic_type"] = topic_type
         if user != "":
             params["user"] = user
-        data = self.data_manager.searchDocument(collection_name = "Topic", 
+        return await self.data_manager.searchDocument(collection_name = "Topic", 
                                                 query = params)
-        result = []
-        for doc in data:
-            doc["_id"] = str(doc["_id"])  
-            result.append(doc)
-        return result
     
-    def get_topics(self, topic_type, user):
-        pipeline = [ 
-        {
-            "$match": { 
-                "user": user,
-                "$or": [
-                    { "is_deleted": False },  # Explicitly False
-                    { "is_deleted": { "$exists": False } }  # Field does not exist
-                ]
-            }
-        },
-        {
-            "$lookup": {
-                "from": "Extraction",         
-                "localField": "id",      
-                "foreignField": "topic_id", 
-                "as": "extracted_items"        
-            },
-        },
-         {
-        "$lookup": {
-            "from": "Extraction_Multi",         
-            "localField": "id",      
-            "foreignField": "topic_id", 
-            "as": "extracted_multi_items"        
-        }
-    }]
-        topics = self.data_manager.fetchTopicWithPipeline(pipeline=pipeline, 
-                                                        collection_name='Topic')
-        data = []
-        for topic in topics:
-            items = [x for x in topic['extracted_items'] if not x.get('is_deleted', False)]
-            total_items = len(items)
-            done_items = len([x for x in items if x.get('done', False)])
-            total_multi_items = len([x for x in topic['extracted_multi_items'] if not x.get('is_deleted', False)])
-            del topic['extracted_items']
-            del topic['extracted_multi_items']
-            data.append({**topic, **{"total_items": total_items, "done_items": done_items, "total_multi_items": total_multi_items}})
-        
-        result = []
-        for doc in data:
-            doc["_id"] = str(doc["_id"])  
-            result.append(doc)
-        return result
+    def topics_filter(self, user):
+        return {**self.live_query, "user": user}
+
+    def topic_with_counts(self, topic):
+        # counters are maintained on writes, topics created before that default to 0
+        for counter in TOPIC_COUNTERS:
+            topic.setdefault(counter, 0)
+        return topic
+
+    async def get_topics(self, topic_type, user):
+        topics = await self.data_manager.searchDocument(collection_name='Topic',
+                                                        query=self.topics_filter(user))
+        return [self.topic_with_counts(topic) for topic in topics]
+
+    async def stream_topics(self, topic_type, user):
+        async for topic in self.data_manager.iterDocuments(collection_name='Topic',
+                                                           query=self.topics_filter(user)):
+            yield self.topic_with_counts(topic)
       
 
-    def get_all_topics(self):
-        params = {"$or": [
-        {"is_deleted": False},
-        {"is_deleted": {"$exists": False}}
-        ]}
-        data = self.data_manager.searchDocument(collection_name = "Topic", 
+    async def get_all_topics(self):
+        params = dict(self.live_query)
+        return await self.data_manager.searchDocument(collection_name = "Topic", 
                                                 query = params)
-        result = []
-        for doc in data:
-            doc["_id"] = str(doc["_id"])  # Convert ObjectId to string
-            result.append(doc)
-        return result
 
 
-    def insert_items(self, items):
-        data = self.data_manager.insertDocuments(collection_name="Extraction", 
+    async def insert_items(self, items):
+        for item in items:
+            item[TOKENS_FIELD] = self.item_search_tokens(item)
+        data = await self.data_manager.insertDocuments(collection_name="Extraction", 
                                                  documents=items)
+        counters = {}
+        for item in items:
+            topic_counters = counters.setdefault(item['topic_id'], {"total_items": 0, "done_items": 0})
+            topic_counters["total_items"] += 1
+            if item.get('done', False):
+                topic_counters["done_items"] += 1
+        await self.increment_topics_counters(counters)
         return data
     
-    def insert_multi_items(self, items):
-        data = self.data_manager.insertDocuments(collection_name="Extraction_Multi", 
+    async def insert_multi_items(self, items):
+        for item in items:
+            item[TOKENS_FIELD] = self.multi_item_search_tokens(item)
+        data = await self.data_manager.insertDocuments(collection_name="Extraction_Multi", 
                                                  documents=items)
+        counters = {}
+        for item in items:
+            topic_counters = counters.setdefault(item['topic_id'], {"total_multi_items": 0})
+            topic_counters["total_multi_items"] += 1
+        await self.increment_topics_counters(counters)
         return data
+
+    async def increment_topics_counters(self, counters):
+        """
+        Applies counter increments to many topics in one bulk_write. The topics'
+        modified_on moves too, so the new counts reach delta sync clients.
+        :param counters: dict of topic id -> increments.
+        """
+        now = int(time.time())
+        operations = []
+        for topic_id, increments in counters.items():
+            increments = {k: v for k, v in increments.items() if v != 0}
+            if len(increments) > 0:
+                operations.append(UpdateOne({"id": topic_id}, {"$inc": increments,
+                                                               "$set": {"modified_on": now}}))
+        if len(operations) > 0:
+            await self.data_manager.bulkWrite("Topic", operations)
+            await self.topic_counts_changed([x for x, increments in counters.items() if any(increments.values())])
+
+    async def reconcile_topic_counters(self):
+        """
+        Rebuilds the materialized topic counters from the items with $group.
+        A topic's counters are only replaced while its counters and modified_on
+        are still as read before counting, topics that changed meanwhile are
+        counted again. An item written before the count whose $inc lands after
+        the rebuild is still counted twice, so run it with writers quiesced.
+        :return: Number of topics whose counters were rebuilt.
+        """
+        live = {"is_deleted": {"$ne": True}}
+        projection = {"id": 1, "modified_on": 1, **{x: 1 for x in TOPIC_COUNTERS}}
+        topic_ids = None
+        rebuilt = 0
+        for _ in range(COUNTED_SET_ATTEMPTS):
+            topic_query = {} if topic_ids is None else {"id": {"$in": topic_ids}}
+            topics = [x async for x in self.data_manager.iterDocuments("Topic", query=topic_query,
+                                                                       projection=projection)]
+            if len(topics) == 0:
+                break
+            match = dict(live) if topic_ids is None else {**live, "topic_id": {"$in": topic_ids}}
+            items = await self.data_manager.fetchTopicWithPipeline(pipeline=[
+                {"$match": match},
+                {"$group": {"_id": "$topic_id",
+                            "total_items": {"$sum": 1},
+                            "done_items": {"$sum": {"$cond": [{"$eq": ["$done", True]}, 1, 0]}}}}],
+                collection_name="Extraction")
+            multi_items = await self.data_manager.fetchTopicWithPipeline(pipeline=[
+                {"$match": match},
+                {"$group": {"_id": "$topic_id", "total_multi_items": {"$sum": 1}}}],
+                collection_name="Extraction_Multi")
+            items = {x['_id']: x for x in items}
+            multi_items = {x['_id']: x for x in multi_items}
+            counts = {}
+            operations = []
+            for topic in topics:
+                counts[topic["_id"]] = {"total_items": items.get(topic.get('id'), {}).get('total_items', 0),
+                                        "done_items": items.get(topic.get('id'), {}).get('done_items', 0),
+                                        "total_multi_items": multi_items.get(topic.get('id'), {}).get('total_multi_items', 0)}
+                guard = {"_id": topic["_id"],
+                         "modified_on": topic.get("modified_on"),
+                         **{x: topic.get(x) for x in TOPIC_COUNTERS}}
+                operations.append(UpdateOne(guard, {"$set": counts[topic["_id"]]}))
+            result = await self.data_manager.bulkWrite("Topic", operations)
+            rebuilt += result.matched_count
+            if result.matched_count == len(operations):
+                break
+            # topics whose counters moved between the read and the write
+            lost = [x async for x in self.data_manager.iterDocuments("Topic",
+                                                                     query={"_id": {"$in": list(counts)}},
+                                                                     projection=projection)
+                    if any(x.get(c) != counts[x["_id"]][c] for c in TOPIC_COUNTERS)]
+            topic_ids = [x["id"] for x in lost if "id" in x]
+            if len(topic_ids) == 0:
+                break
+        else:
+            self.logger.error(f"Counters of topics {topic_ids} kept changing, run again with writers stopped")
+        if rebuilt > 0:
+            await self.topic_counts_changed()
+        return rebuilt
+
+    def item_search_tokens(self, item):
+        return tokenize(f"{item.get('title', '')} {item.get('value', '')}")
+
+    def multi_item_search_tokens(self, item):
+        values = " ".join(str(x.get('value', '')) for x in item.get('items', []))
+        return tokenize(f"{item.get('title', '')} {values}")
+
+    async def backfill_search_tokens(self, batch_size=500):
+        """Adds search_tokens to documents stored before prefix search existed."""
+        updated = 0
+        for collection_name, tokens_for in [("Extraction", self.item_search_tokens),
+                                            ("Extraction_Multi", self.multi_item_search_tokens)]:
+            operations = []
+            async for doc in self.data_manager.iterDocuments(collection_name,
+                                                             query={TOKENS_FIELD: {"$exists": False}},
+                                                             projection={"title": 1, "value": 1, "items": 1}):
+                operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {TOKENS_FIELD: tokens_for(doc)}}))
+                if len(operations) >= batch_size:
+                    await self.data_manager.bulkWrite(collection_name, operations)
+                    updated += len(operations)
+                    operations = []
+            if len(operations) > 0:
+                await self.data_manager.bulkWrite(collection_name, operations)
+                updated += len(operations)
+        return updated
     
-    def update_topic(self, id: str, frequency: str, items:list, last_extraction_epoch: int, topic_name: str,topic_type: str):
+    async def migrate_is_deleted(self, batch_size=1000, pause_sec=0.0, progress=None):
+        """
+        Sets is_deleted: False on soft-delete documents stored without it, so
+        reads can filter on NOT_DELETED. Walks each collection in _id order in
+        short batches, saving the last _id in the Migration collection after
+        every batch, so an interrupted run resumes where it stopped. The
+        obsolete full indexes are dropped once every collection is done.
+        :param batch_size: Documents scanned per batch.
+        :param pause_sec: Sleep between batches to limit the load on the server.
+        :param progress: Optional callable(collection_name, scanned, updated).
+        :return: dict of collection name -> number of updated documents.
+        """
+        updated = {}
+        for collection_name in SOFT_DELETE_COLLECTIONS:
+            migration = {"name": "is_deleted", "collection": collection_name}
+            states = await self.data_manager.searchDocument(MIGRATIONS_COLLECTION, migration)
+            state = states[0] if len(states) > 0 else {}
+            updated[collection_name] = state.get("updated", 0)
+            if state.get("done", False):
+                continue
+            last_id = state.get("last_id")
+            scanned = state.get("scanned", 0)
+            while True:
+                query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+                docs = await self.data_manager.findBatch(collection_name, query,
+                                                         projection={"is_deleted": 1},
+                                                         sort=[("_id", 1)],
+                                                         limit=batch_size)
+                if len(docs) == 0:
+                    break
+                ids = [x["_id"] for x in docs if "is_deleted" not in x]
+                if len(ids) > 0:
+                    result = await self.data_manager.updateDocument(collection_name,
+                                                                    query={"_id": {"$in": ids}, "is_deleted": {"$exists": False}},
+                                                                    update={"is_deleted": False},
+                                                                    many=True)
+                    updated[collection_name] += result["modified_count"]
+                last_id = docs[-1]["_id"]
+                scanned += len(docs)
+                await self.data_manager.upsertDocument(MIGRATIONS_COLLECTION, migration,
+                                                       {"last_id": last_id, "scanned": scanned,
+                                                        "updated": updated[collection_name]})
+                if progress is not None:
+                    progress(collection_name, scanned, updated[collection_name])
+                if pause_sec > 0:
+                    await asyncio.sleep(pause_sec)
+            await self.data_manager.upsertDocument(MIGRATIONS_COLLECTION, migration,
+                                                   {"done": True, "finished_on": int(time.time())})
+        for collection_name, index_name in OBSOLETE_INDEXES:
+            if await self.data_manager.dropIndex(collection_name, index_name):
+                self.logger.info(f"Dropped index {index_name} on {collection_name}")
+        return updated
+
+    def retention_job(self, retention_days=None, batch_size=500, pause_sec=0.0):
+        return RetentionJob(self.data_manager, self.audio_store,
+                            retention_days=self.settings.RETENTION_DAYS if retention_days is None else retention_days,
+                            batch_size=batch_size,
+                            pause_sec=pause_sec)
+
+    async def update_topic(self, id: str, frequency: str, items:list, last_extraction_epoch: int, topic_name: str,topic_type: str):
         params =  {}
         if frequency is not None:
             params["frequency"] = frequency
@@ -298,60 +775,51 @@ class MainApp:
         if topic_type is not None:
             params["topic_type"] = topic_type
         params["modified_on"] = int(time.time())   
-        self.data_manager.updateDocument(collection_name="Topic", 
+        before = await self.data_manager.findOneAndUpdate(collection_name="Topic", 
                                          query={"id": id}, 
-                                         update=params)
-        self.write_last_time_topics_changed()
+                                         update=params,
+                                         projection={"user": 1})
+        if before is not None:
+            # the extractor's own last_extraction_epoch updates must not wake it up again
+            extract = any(key not in ("last_extraction_epoch", "modified_on") for key in params)
+            await self.topics_changed(before.get('user'), extract=extract)
 
 
     
-    def insert_topic(self, topic):
-        self.data_manager.insertDocuments(collection_name = "Topic", 
+    async def insert_topic(self, topic):
+        await self.data_manager.insertDocuments(collection_name = "Topic", 
                                           documents = topic)
-        self.write_last_time_topics_changed()
+        await self.topics_changed(topic.get('user'), extract=True)
 
-    def delete_item(self, id, is_multi_item):
-        if is_multi_item:
-            self.data_manager.updateDocument(collection_name = "Extraction_Multi", 
-                                             query = {"id": id}, 
-                                             update = {"is_deleted": True,  "modified_on": int(time.time())})
-        else:
-            self.data_manager.updateDocument(collection_name = "Extraction", 
-                                             query = {"audio_name": id+'.mp3'}, 
-                                             update = {"is_deleted": True, "modified_on": int(time.time())})
+    async def delete_item(self, id, is_multi_item):
+        await self.bulk_update_items([{"id": id, "op": "delete_multi" if is_multi_item else "delete"}])
 
-    def delete_topic(self, id):
-        self.data_manager.updateDocument(collection_name = "Topic", 
+    async def delete_topic(self, id):
+        before = await self.data_manager.findOneAndUpdate(collection_name = "Topic", 
                                          query = {"id": id}, 
-                                         update = {"is_deleted": True, "modified_on": int(time.time())})
+                                         update = {"is_deleted": True, "modified_on": int(time.time())},
+                                         projection = {"user": 1})
+        if before is not None:
+            await self.topics_changed(before.get('user'))
         
-    def delete_journal_item(self, id):
-        self.data_manager.updateDocument(collection_name = "Journal", 
+    async def delete_journal_item(self, id):
+        await self.data_manager.updateDocument(collection_name = "Journal", 
                                          query = {"id": id}, 
                                          update = {"is_deleted": True, "modified_on": int(time.time())})
 
-    def update_journal_item(self, id, updated_text):
-        self.data_manager.updateDocument(collection_name = "Journal", 
+    async def update_journal_item(self, id, updated_text):
+        await self.data_manager.updateDocument(collection_name = "Journal", 
                                          query = {"id": id}, 
                                          update = {"transcript": updated_text, "modified_on": int(time.time())})
 
-    def write_last_time_topics_changed(self):
-        data = {"last_time_topics_changed": int(time.time())}
-        file_path = os.path.join(SHARED_DIR, SHARED_FILE)
-        print('Writting to the file')
-        try:
-            with open(file_path, "w") as f:
-                json.dump(data, f)
-            return {"message": "JSON file written successfully"}
-        except Exception as e:
-            print(f"Error with writting to the file: {e}")
-
-    def verify_password(self, plain_password: str, hashed_password: str) -> bool:
-        return pwd_context.verify(plain_password, hashed_password)
+    async def verify_password(self, plain_password: str, hashed_password: str) -> bool:
+        # bcrypt is CPU bound, run it on the dedicated executor, off the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.password_executor, pwd_context.verify, plain_password, hashed_password)
 
-    def authenticate_user(self,username: str, password: str):
-        user = self.get_user(username)
-        if not user or not self.verify_password(password, user["password"]):
+    async def authenticate_user(self,username: str, password: str):
+        user = await self.get_user(username)
+        if not user or not await self.verify_password(password, user["password"]):
             return False
         return user
 
@@ -362,40 +830,60 @@ class MainApp:
         return jwt.encode(to_encode, self.settings.ZAIA_SECRET_KEY, algorithm=self.algorithm)
     
     
-    def hash_password(self, password: str) -> str:
-        return pwd_context.hash(password)
+    async def hash_password(self, password: str) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.password_executor, pwd_context.hash, password)
+
+    def verify_access_token(self, token: str):
+        """
+        Returns the username of a valid access token, or None if it has no subject.
+        Raises JWTError for invalid or expired tokens. Verified tokens are cached
+        by their hash until they expire, so repeated requests skip the HMAC check.
+        """
+        key = self.hash_token(token)
+        username = self.token_cache.get(key)
+        if username is not None:
+            return username
+        payload = jwt.decode(token, self.settings.ZAIA_SECRET_KEY, algorithms=[self.algorithm])
+        username = payload.get("sub")
+        expires_in = payload.get("exp", 0) - time.time()
+        if username is not None and expires_in > 0:
+            self.token_cache.set(key, username, ttl=expires_in)
+        return username
     
-    def get_user(self, username: str):
-        user = self.data_manager.searchDocument(collection_name='User', 
+    async def get_user(self, username: str):
+        user = await self.data_manager.searchDocument(collection_name='User', 
                                                 query={"username": username})
         if len(user)>0:
             return user[0]
         
         return None
 
-    def create_user(self, username: str, password: str):
+    async def create_user(self, username: str, password: str):
         """Save user to the database with hashed password"""
-        hashed_password = pwd_context.hash(password)
-        self.data_manager.insertDocuments('User', {"username": username, "password": hashed_password})
+        hashed_password = await self.hash_password(password)
+        await self.data_manager.insertDocuments('User', {"username": username, "password": hashed_password})
         access_token = self.create_access_token(data={"sub": username})
-        refresh_token = self.create_refresh_token(username)
+        refresh_token = await self.create_refresh_token(username)
         return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
        
     def hash_token(self, token: str) -> str:
         return hashlib.sha256(token.encode()).hexdigest()
 
-    def create_refresh_token(self, username):
+    async def create_refresh_token(self, username):
         refresh_token = secrets.token_urlsafe(64) 
         hashed_token = self.hash_token(refresh_token)
-        self.data_manager.insertDocuments(collection_name='RefreshToken', 
+        expires_on = int(time.time())+REFRESH_TOKEN_EXPIRE_DAYS_IN_SEC
+        await self.data_manager.insertDocuments(collection_name='RefreshToken', 
                                           documents = {"refresh_token": hashed_token,
                                               "username": username,
-                                              "expires_on": int(time.time())+REFRESH_TOKEN_EXPIRE_DAYS_IN_SEC})
+                                              "expires_on": expires_on,
+                                              "expires_at": expires_at(expires_on)})
         return refresh_token
     
-    def validate_refresh_token(self, refresh_token: str) -> str:
+    async def validate_refresh_token(self, refresh_token: str) -> str:
         hashed_token = self.hash_token(refresh_token)
-        token_entry = self.data_manager.searchDocument(collection_name='RefreshToken', 
+        token_entry = await self.data_manager.searchDocument(collection_name='RefreshToken', 
                                                        query={"refresh_token": hashed_token})
         if len(token_entry)>0:
             token_entry = token_entry[0]
@@ -404,48 +892,20 @@ class MainApp:
         
         return None 
     
-    def update_password(self, username: str, password: str):
-        user = self.get_user(username)
+    async def update_password(self, username: str, password: str):
+        user = await self.get_user(username)
         if user:
-            hashed_password = pwd_context.hash(password)
-            self.data_manager.updateDocument(collection_name = 'User',
+            hashed_password = await self.hash_password(password)
+            await self.data_manager.updateDocument(collection_name = 'User',
                                              query = {"username": username}, 
                                              update = {"password": hashed_password})
             access_token = self.create_access_token(data={"sub": username})
-            refresh_token = self.create_refresh_token(username)
+            refresh_token = await self.create_refresh_token(username)
             return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
         else:
             return {}
     
-    def speech_to_text(self, user, audio_bytes):
-        try:
-            deepgram = DeepgramClient(self.settings.DEEPGRAM_API_KEY)
-
-            payload: FileSource = {
-                "buffer": audio_bytes,
-            }
-
-            options = PrerecordedOptions(
-                model="nova-3",
-                smart_format=True,
-            )
-
-            response = deepgram.listen.rest.v("1").transcribe_file(payload, options)
-
-            transcript = response.results.channels[0].alternatives[0].transcript
-            if len(transcript) == 0:
-                return {"id": "", "transcript": ""}
-            journal_id = self.insert_journal(user, transcript)
-
-
-            return {"id": journal_id, "transcript": transcript}
-
-        except Exception as e:
-            print(f"Exception: {e}")
-            return {"id": "", "transcript": ""}
-        
-    
-    def insert_journal(self, user, text):
+    async def insert_journal(self, user, text):
         now = time.time()
         journal = { "id": str(uuid.uuid4()),
                      "user": user, 
@@ -454,6 +914,6 @@ class MainApp:
                      'modified_on': int(now),
                     'is_deleted':  False
                     }
-        self.data_manager.insertDocuments(collection_name = "Journal", 
+        await self.data_manager.insertDocuments(collection_name = "Journal", 
                                           documents = journal)
         return journal['id']
\ No newline at end of file
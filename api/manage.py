@@ -0,0 +1,119 @@
+import argparse
+import asyncio
+import sys
+
+from main_app import MainApp
+
+
+async def ensure_indexes(main_app, args):
+    await main_app.ensure_indexes()
+    print("Indexes applied.")
+    return 0
+
+
+async def explain_report(main_app, args):
+    report = await main_app.explain_query_shapes()
+    collscans = 0
+    for entry in report:
+        if entry["collscan"]:
+            collscans += 1
+            status = "COLLSCAN"
+        else:
+            status = "IXSCAN " + ", ".join(x for x in entry["indexes"] if x)
+        print(f"{entry['collection']:<18} {entry['name']:<28} {status}")
+    print(f"{collscans} of {len(report)} query shapes use a collection scan.")
+    return 1 if collscans > 0 else 0
+
+
+async def backfill_search_tokens(main_app, args):
+    updated = await main_app.backfill_search_tokens()
+    print(f"Added search tokens to {updated} documents.")
+    return 0
+
+
+async def reconcile_counters(main_app, args):
+    updated = await main_app.reconcile_topic_counters()
+    print(f"Rebuilt counters of {updated} topics.")
+    return 0
+
+
+async def migrate_is_deleted(main_app, args):
+    def progress(collection_name, scanned, updated):
+        print(f"{collection_name:<18} scanned {scanned:>9} updated {updated:>9}", flush=True)
+
+    updated = await main_app.migrate_is_deleted(batch_size=args.batch_size,
+                                                pause_sec=args.pause_ms / 1000,
+                                                progress=progress)
+    for collection_name, count in updated.items():
+        print(f"{collection_name:<18} {count} documents got is_deleted.")
+    return 0
+
+
+async def retention(main_app, args):
+    job = main_app.retention_job(retention_days=args.days,
+                                 batch_size=args.batch_size,
+                                 pause_sec=args.pause_ms / 1000)
+    if args.dry_run:
+        report = await job.report()
+        for name, entry in report.items():
+            if isinstance(entry, dict):
+                count = entry.get("documents", entry.get("objects"))
+                print(f"{name:<18} {count:>9} {entry['bytes']:>14} bytes")
+        print(f"{report['total_bytes']} bytes reclaimable, older than {job.retention_days} days.")
+        return 0
+
+    def progress(collection_name, deleted):
+        print(f"{collection_name:<18} deleted {deleted:>9}", flush=True)
+
+    backfilled = await job.backfill_token_expiry()
+    print(f"Added expires_at to {backfilled} refresh tokens.")
+    deleted = await job.purge(progress=progress)
+    for name, count in deleted.items():
+        print(f"{name:<18} {count} removed.")
+    if args.compact:
+        for name, freed in (await job.compact()).items():
+            print(f"{name:<18} compact freed {freed} bytes.")
+    return 0
+
+
+COMMANDS = {
+    "ensure-indexes": ensure_indexes,
+    "explain-report": explain_report,
+    "backfill-search-tokens": backfill_search_tokens,
+    "reconcile-counters": reconcile_counters,
+    "migrate-is-deleted": migrate_is_deleted,
+    "retention": retention,
+}
+
+
+async def run(args):
+    main_app = MainApp()
+    try:
+        return await COMMANDS[args.command](main_app, args)
+    finally:
+        await main_app.closeConnection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Zaia API maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("ensure-indexes", help="Create all registered indexes")
+    subparsers.add_parser("explain-report", help="Explain MainApp query shapes and flag collection scans")
+    subparsers.add_parser("backfill-search-tokens", help="Add prefix search tokens to existing items")
+    subparsers.add_parser("reconcile-counters",
+                          help="Rebuild the topic item counters with $group; run it with the API stopped, "
+                               "item writes during the rebuild can still leave counters off")
+    migrate = subparsers.add_parser("migrate-is-deleted",
+                                    help="Backfill is_deleted on soft-delete collections, resumable")
+    migrate.add_argument("--batch-size", type=int, default=1000, help="Documents per batch")
+    migrate.add_argument("--pause-ms", type=int, default=0, help="Pause between batches")
+    retention_parser = subparsers.add_parser("retention",
+                                             help="Purge old soft-deleted data, their MP3s and expired refresh tokens")
+    retention_parser.add_argument("--dry-run", action="store_true", help="Only report the reclaimable bytes")
+    retention_parser.add_argument("--days", type=int, default=None, help="Retention period, default RETENTION_DAYS; a shorter one "
+                                       "hides deletions from /changes/ clients, which only resync after RETENTION_DAYS")
+    retention_parser.add_argument("--batch-size", type=int, default=500, help="Documents per batch")
+    retention_parser.add_argument("--pause-ms", type=int, default=0, help="Pause between batches")
+    retention_parser.add_argument("--compact", action="store_true", help="Run compact on the collections afterwards")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
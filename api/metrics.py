@@ -0,0 +1,149 @@
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+from pymongo import monitoring
+
+# with several uvicorn workers every process writes its samples to this
+# directory and /metrics merges them, whichever worker answers the scrape
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+COUNT_BUCKETS = (0, 1, 10, 100, 1_000, 10_000, 100_000)
+
+UNMATCHED_ROUTE = "unmatched"
+
+HTTP_REQUEST_DURATION = Histogram("zaia_http_request_duration_seconds",
+                                  "Time until the last byte of the response was sent.",
+                                  ["method", "route", "status"], buckets=LATENCY_BUCKETS)
+HTTP_RESPONSE_SIZE = Histogram("zaia_http_response_size_bytes",
+                               "Size of the response body.",
+                               ["method", "route"], buckets=SIZE_BUCKETS)
+HTTP_REQUESTS_IN_PROGRESS = Gauge("zaia_http_requests_in_progress",
+                                  "Requests being handled.",
+                                  ["method"], multiprocess_mode="livesum")
+
+MONGO_COMMAND_DURATION = Histogram("zaia_mongo_command_duration_seconds",
+                                   "MongoDB command round trip as reported by the driver.",
+                                   ["collection", "command", "outcome"], buckets=LATENCY_BUCKETS)
+MONGO_DOCUMENTS_RETURNED = Histogram("zaia_mongo_documents_returned",
+                                     "Documents in the reply of find, getMore and aggregate.",
+                                     ["collection", "command"], buckets=COUNT_BUCKETS)
+
+EXTERNAL_CALL_DURATION = Histogram("zaia_external_call_duration_seconds",
+                                   "Calls to S3 and Deepgram.",
+                                   ["service", "operation", "outcome"], buckets=LATENCY_BUCKETS)
+
+AUDIO_CACHE_LOOKUPS = Counter("zaia_audio_cache_lookups_total",
+                              "Audio cache lookups by result.",
+                              ["result"])
+AUDIO_CACHE_BYTES = Gauge("zaia_audio_cache_bytes",
+                          "Bytes of MP3 in the disk cache.",
+                          multiprocess_mode="mostrecent")
+
+# commands whose reply carries documents in a cursor batch
+CURSOR_COMMANDS = {"find", "aggregate", "getMore"}
+
+
+@contextmanager
+def timed_call(service, operation):
+    """Records the duration of a call to an external service, failed or not."""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        EXTERNAL_CALL_DURATION.labels(service, operation, outcome).observe(time.perf_counter() - start)
+
+
+def render_metrics():
+    """
+    Exposition of all metrics.
+    :return: (body, content type)
+    """
+    if os.environ.get(MULTIPROC_DIR_ENV):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """Drops the live gauges of a worker that exited, only needed in multiprocess mode."""
+    if os.environ.get(MULTIPROC_DIR_ENV):
+        multiprocess.mark_process_dead(pid)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency, status and response size per route.
+    Routes are labelled with their path template, e.g. /topics/{topic_id},
+    so the number of series stays bounded. Streaming responses are timed
+    until their last chunk.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        start = time.perf_counter()
+        response = {"status": 500, "size": 0}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["size"] += len(message.get("body", b""))
+            await send(message)
+
+        HTTP_REQUESTS_IN_PROGRESS.labels(method).inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_PROGRESS.labels(method).dec()
+            route = scope.get("route")
+            path = getattr(route, "path", UNMATCHED_ROUTE)
+            HTTP_REQUEST_DURATION.labels(method, path, str(response["status"])).observe(time.perf_counter() - start)
+            HTTP_RESPONSE_SIZE.labels(method, path).observe(response["size"])
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    pymongo command listener timing every command per collection and
+    operation. The collection is only in the started event, so it is kept
+    until the command succeeds or fails.
+    """
+    def __init__(self):
+        self.pending = {}
+
+    def key(self, event):
+        return event.connection_id, event.request_id, event.operation_id
+
+    def started(self, event):
+        command_name = event.command_name
+        if command_name == "getMore":
+            collection = event.command.get("collection", "")
+        else:
+            collection = event.command.get(command_name, "")
+        self.pending[self.key(event)] = collection if isinstance(collection, str) else ""
+
+    def succeeded(self, event):
+        collection = self.pending.pop(self.key(event), "")
+        MONGO_COMMAND_DURATION.labels(collection, event.command_name, "ok").observe(event.duration_micros / 1e6)
+        if event.command_name in CURSOR_COMMANDS:
+            cursor = event.reply.get("cursor", {})
+            batch = cursor.get("firstBatch", cursor.get("nextBatch", []))
+            MONGO_DOCUMENTS_RETURNED.labels(collection, event.command_name).observe(len(batch))
+
+    def failed(self, event):
+        collection = self.pending.pop(self.key(event), "")
+        MONGO_COMMAND_DURATION.labels(collection, event.command_name, "error").observe(event.duration_micros / 1e6)
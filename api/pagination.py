@@ -0,0 +1,122 @@
+import base64
+import json
+import re
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING
+
+MAX_LIMIT = 500
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+SORTS = {
+    "newest": [("created_on", DESCENDING), ("_id", DESCENDING)],
+    "oldest": [("created_on", ASCENDING), ("_id", ASCENDING)],
+    "relevance": None,
+}
+
+FIELD_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_.]*$")
+
+
+class Page:
+    """Pagination request for a list endpoint, built from the query parameters."""
+    def __init__(self, limit=None, cursor=None, sort=None, fields=None, has_text_search=False):
+        self.offset = 0
+        self.after = None
+        cursor_payload = decode_cursor(cursor) if cursor is not None else None
+        if cursor_payload is not None:
+            if sort is not None and sort != cursor_payload["s"]:
+                raise ValueError("cursor was issued for a different sort")
+            sort = cursor_payload["s"]
+        if sort is None and limit is not None:
+            sort = "relevance" if has_text_search else "newest"
+        if sort is not None and sort not in SORTS:
+            raise ValueError(f"sort must be one of {', '.join(SORTS)}")
+        if sort == "relevance" and not has_text_search:
+            raise ValueError("relevance sort requires a search term")
+        if limit is not None and (limit < 1 or limit > MAX_LIMIT):
+            raise ValueError(f"limit must be between 1 and {MAX_LIMIT}")
+        if cursor_payload is not None:
+            if sort == "relevance":
+                self.offset = cursor_payload["o"]
+            else:
+                self.after = (cursor_payload["c"], ObjectId(cursor_payload["i"]))
+        self.limit = limit
+        self.sort = sort
+        self.fields = parse_fields(fields)
+
+    def sort_spec(self):
+        """Sort for the data layer, 'relevance' or a list of (field, direction)."""
+        if self.sort == "relevance":
+            return "relevance"
+        return SORTS.get(self.sort)
+
+    def apply(self, filter_query):
+        """Adds the keyset condition for the requested page to the filter."""
+        if self.after is None:
+            return filter_query
+        created_on, last_id = self.after
+        op = "$lt" if self.sort == "newest" else "$gt"
+        keyset = {"$or": [{"created_on": {op: created_on}},
+                          {"created_on": created_on, "_id": {op: last_id}}]}
+        return {**filter_query, "$and": filter_query.get("$and", []) + [keyset]}
+
+    def fetch_limit(self):
+        """One extra document tells whether there is a next page."""
+        return self.limit + 1 if self.limit is not None else None
+
+    def next_cursor(self, docs):
+        """
+        Trims the extra document and returns the cursor for the next page.
+        :param docs: Documents fetched with fetch_limit().
+        :return: Tuple (docs, next_cursor), next_cursor is None on the last page.
+        """
+        if self.limit is None or len(docs) <= self.limit:
+            return docs, None
+        docs = docs[:self.limit]
+        return docs, self.cursor_after(docs[-1])
+
+    def cursor_after(self, last):
+        """Cursor of the page that follows a full page ending with the given document."""
+        if self.sort == "relevance":
+            return encode_cursor({"s": self.sort, "o": self.offset + self.limit})
+        return encode_cursor({"s": self.sort, "c": last.get("created_on"), "i": str(last["_id"])})
+
+
+def encode_cursor(payload):
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_payload(cursor):
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    return json.loads(raw)
+
+
+def decode_cursor(cursor):
+    try:
+        payload = decode_payload(cursor)
+        if payload["s"] == "relevance":
+            int(payload["o"])
+        else:
+            ObjectId(payload["i"])
+            payload["c"]
+        return payload
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise ValueError("invalid cursor")
+
+
+def parse_fields(fields):
+    """
+    Parses the comma separated fields= parameter.
+    :param fields: e.g. "id,title,created_on" or None.
+    :return: List of field names or None for the full document.
+    """
+    if fields is None or fields.strip() == "":
+        return None
+    names = [x.strip() for x in fields.split(",") if x.strip() != ""]
+    for name in names:
+        if not FIELD_RE.match(name):
+            raise ValueError(f"invalid field name: {name}")
+    # created_on and _id are always returned, the cursor is built from them
+    return list(dict.fromkeys(names + ["created_on"]))
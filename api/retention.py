@@ -0,0 +1,158 @@
+import asyncio
+import datetime
+import logging
+import time
+
+from pymongo import UpdateOne
+
+from index_registry import SOFT_DELETE_COLLECTIONS
+
+REFRESH_TOKENS_COLLECTION = "RefreshToken"
+# collections whose documents own an MP3 in S3
+AUDIO_COLLECTIONS = ["Extraction"]
+# collections whose documents belong to a topic and go when the topic goes
+TOPIC_CHILD_COLLECTIONS = ["Extraction", "Extraction_Multi"]
+
+
+def expires_at(expires_on):
+    """TTL indexes only work on BSON dates, expires_on is an epoch in seconds."""
+    return datetime.datetime.fromtimestamp(expires_on, datetime.timezone.utc)
+
+
+class RetentionJob:
+    """
+    Removes data that is no longer reachable: soft-deleted documents older
+    than the retention period, the items of expired topics, their MP3s in S3
+    and expired refresh tokens. Everything runs in short batches so it can be
+    interrupted and started again at any time.
+    """
+    def __init__(self, data_manager, audio_store, retention_days, batch_size=500, pause_sec=0.0):
+        self.data_manager = data_manager
+        self.audio_store = audio_store
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.pause_sec = pause_sec
+        self.logger = logging.getLogger('Zaia')
+
+    def cutoff(self):
+        return int(time.time()) - self.retention_days * 86400
+
+    def expired(self, cutoff):
+        return {"is_deleted": True, "modified_on": {"$lt": cutoff}}
+
+    async def expired_topic_ids(self, cutoff):
+        topics = await self.data_manager.findBatch(collection_name="Topic",
+                                                   query=self.expired(cutoff),
+                                                   projection={"id": 1})
+        return [x['id'] for x in topics if 'id' in x]
+
+    async def purge_queries(self):
+        """Filter of the purgeable documents of every collection, topics last."""
+        cutoff = self.cutoff()
+        topic_ids = await self.expired_topic_ids(cutoff)
+        queries = []
+        for collection_name in SOFT_DELETE_COLLECTIONS:
+            query = self.expired(cutoff)
+            if collection_name in TOPIC_CHILD_COLLECTIONS and len(topic_ids) > 0:
+                query = {"$or": [query, {"topic_id": {"$in": topic_ids}}]}
+            queries.append((collection_name, query))
+        # the items of a topic are found through the topic, so it goes last
+        queries.sort(key=lambda x: x[0] == "Topic")
+        return queries
+
+    async def report(self):
+        """
+        Dry run: what a purge would remove, nothing is deleted.
+        :return: dict of collection name -> {"documents", "bytes"}, plus "s3" and "total_bytes".
+        """
+        report = {}
+        audio_names = []
+        for collection_name, query in await self.purge_queries():
+            stats = await self.data_manager.fetchTopicWithPipeline(pipeline=[
+                {"$match": query},
+                {"$group": {"_id": None,
+                            "documents": {"$sum": 1},
+                            "bytes": {"$sum": {"$bsonSize": "$$ROOT"}}}}],
+                collection_name=collection_name)
+            stats = stats[0] if len(stats) > 0 else {}
+            report[collection_name] = {"documents": stats.get("documents", 0), "bytes": stats.get("bytes", 0)}
+            if collection_name in AUDIO_COLLECTIONS:
+                async for doc in self.data_manager.iterDocuments(collection_name, query=query,
+                                                                 projection={"audio_name": 1}):
+                    if doc.get("audio_name"):
+                        audio_names.append(doc["audio_name"])
+        stats = await self.data_manager.fetchTopicWithPipeline(pipeline=[
+            {"$match": {"expires_on": {"$lt": int(time.time())}}},
+            {"$group": {"_id": None,
+                        "documents": {"$sum": 1},
+                        "bytes": {"$sum": {"$bsonSize": "$$ROOT"}}}}],
+            collection_name=REFRESH_TOKENS_COLLECTION)
+        stats = stats[0] if len(stats) > 0 else {}
+        report[REFRESH_TOKENS_COLLECTION] = {"documents": stats.get("documents", 0), "bytes": stats.get("bytes", 0)}
+        sizes = await asyncio.to_thread(self.audio_store.object_sizes, audio_names)
+        report["s3"] = {"objects": len(sizes), "bytes": sum(sizes.values())}
+        report["total_bytes"] = sum(x["bytes"] for x in report.values())
+        return report
+
+    async def purge(self, progress=None):
+        """
+        Deletes the purgeable documents batch by batch. The MP3s of a batch are
+        deleted from S3 first, documents whose MP3 could not be deleted are
+        kept for the next run.
+        :param progress: Optional callable(collection_name, deleted).
+        :return: dict of collection name -> deleted documents, plus "s3" objects.
+        """
+        deleted = {"s3": 0}
+        for collection_name, query in await self.purge_queries():
+            deleted[collection_name] = 0
+            skip_ids = []
+            while True:
+                batch_query = {**query, "_id": {"$nin": skip_ids}} if len(skip_ids) > 0 else query
+                docs = await self.data_manager.findBatch(collection_name, batch_query,
+                                                         projection={"audio_name": 1},
+                                                         limit=self.batch_size)
+                if len(docs) == 0:
+                    break
+                ids = [x["_id"] for x in docs]
+                if collection_name in AUDIO_COLLECTIONS:
+                    audio = {x["_id"]: x["audio_name"] for x in docs if x.get("audio_name")}
+                    failed = await asyncio.to_thread(self.audio_store.delete_objects, list(audio.values()))
+                    deleted["s3"] += len(audio) - len(failed)
+                    kept = [_id for _id, name in audio.items() if name in failed]
+                    skip_ids.extend(kept)
+                    ids = [x for x in ids if x not in kept]
+                deleted[collection_name] += await self.data_manager.deleteDocument(collection_name,
+                                                                                   query={"_id": {"$in": ids}},
+                                                                                   many=True)
+                if progress is not None:
+                    progress(collection_name, deleted[collection_name])
+                if self.pause_sec > 0:
+                    await asyncio.sleep(self.pause_sec)
+        deleted[REFRESH_TOKENS_COLLECTION] = await self.data_manager.deleteDocument(
+            REFRESH_TOKENS_COLLECTION, query={"expires_on": {"$lt": int(time.time())}}, many=True)
+        return deleted
+
+    async def backfill_token_expiry(self):
+        """Adds expires_at to refresh tokens created before the TTL index existed."""
+        updated = 0
+        operations = []
+        async for doc in self.data_manager.iterDocuments(REFRESH_TOKENS_COLLECTION,
+                                                         query={"expires_at": {"$exists": False}},
+                                                         projection={"expires_on": 1}):
+            operations.append(UpdateOne({"_id": doc["_id"]},
+                                        {"$set": {"expires_at": expires_at(doc.get("expires_on", 0))}}))
+            if len(operations) >= self.batch_size:
+                await self.data_manager.bulkWrite(REFRESH_TOKENS_COLLECTION, operations)
+                updated += len(operations)
+                operations = []
+        if len(operations) > 0:
+            await self.data_manager.bulkWrite(REFRESH_TOKENS_COLLECTION, operations)
+            updated += len(operations)
+        return updated
+
+    async def compact(self):
+        """Runs compact on the purged collections so the freed space goes back to the OS."""
+        freed = {}
+        for collection_name in SOFT_DELETE_COLLECTIONS + [REFRESH_TOKENS_COLLECTION]:
+            freed[collection_name] = await self.data_manager.compactCollection(collection_name)
+        return freed
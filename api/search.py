@@ -0,0 +1,79 @@
+import re
+
+TOKENS_FIELD = "search_tokens"
+MIN_TOKEN_LENGTH = 2
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+PHRASE_RE = re.compile(r'"([^"]+)"')
+
+
+def tokenize(text):
+    """
+    Splits text into the distinct lowercase words stored in search_tokens.
+    :param text: Text to tokenize.
+    :return: List of tokens in order of first appearance.
+    """
+    if not text:
+        return []
+    tokens = TOKEN_RE.findall(text.lower())
+    return list(dict.fromkeys(x for x in tokens if len(x) >= MIN_TOKEN_LENGTH))
+
+
+def parse_search_query(search_text):
+    """
+    Splits a user search string into a $text search string and prefix terms.
+    Quoted parts are phrases, words ending with * are prefix queries and the
+    remaining words are stemmed full-text terms.
+    :param search_text: Raw search string from the API.
+    :return: Tuple (text_search, prefixes), text_search may be empty.
+    """
+    phrases = PHRASE_RE.findall(search_text)
+    rest = PHRASE_RE.sub(" ", search_text)
+    terms = []
+    prefixes = []
+    for word in rest.split():
+        if word.endswith("*"):
+            prefix = "".join(TOKEN_RE.findall(word.lower()))
+            if len(prefix) > 0:
+                prefixes.append(prefix)
+        else:
+            terms.append(word)
+    text_search = " ".join(terms + [f'"{x}"' for x in phrases])
+    return text_search.strip(), prefixes
+
+
+def build_projection(fields=None, with_score=False):
+    """
+    Builds the projection for item queries.
+    :param fields: List of fields to return, None returns the full document.
+    :param with_score: Include the textScore of a $text query as score.
+    :return: Projection dict.
+    """
+    if fields is not None:
+        projection = {x: 1 for x in fields}
+    else:
+        projection = {TOKENS_FIELD: 0}
+    if with_score:
+        projection["score"] = {"$meta": "textScore"}
+    return projection
+
+
+def build_search_query(search_text):
+    """
+    Builds the query for a search string.
+    :param search_text: Raw search string from the API.
+    :return: Tuple (query, has_text_score). has_text_score is True when the
+             search has full-text terms and can be ranked by relevance.
+    """
+    text_search, prefixes = parse_search_query(search_text)
+    query = {}
+    if len(text_search) > 0:
+        query["$text"] = {"$search": text_search}
+    if len(prefixes) > 0:
+        # anchored, case sensitive regexes on lowercase tokens use the index bounds
+        query[TOKENS_FIELD] = {"$all": [re.compile("^" + re.escape(x)) for x in prefixes]}
+    return query, len(text_search) > 0
+
+
+def has_text_search(search_text):
+    return search_text is not None and len(parse_search_query(search_text)[0]) > 0
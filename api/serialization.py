@@ -0,0 +1,31 @@
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+
+# NaN and +-inf are written as null by orjson itself
+OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def default(obj):
+    """Types orjson does not know, MongoDB documents only add ObjectId."""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content):
+    return orjson.dumps(content, default=default, option=OPTIONS)
+
+
+def dumps_line(content):
+    """One NDJSON record, newline included."""
+    return orjson.dumps(content, default=default, option=OPTIONS | orjson.OPT_APPEND_NEWLINE)
+
+
+class ZaiaJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson. Endpoints that return it directly with
+    raw MongoDB documents skip FastAPI's jsonable_encoder pass entirely.
+    """
+    def render(self, content):
+        return dumps(content)
@@ -0,0 +1,79 @@
+import asyncio
+import datetime
+import time
+
+from bson import ObjectId
+
+import events
+from events import EVENTS_COLLECTION, TOPICS_CHANGED, EventBus
+
+
+class CappedCollection:
+    """Events collection in insertion order whose tailable cursors can be killed."""
+    def __init__(self):
+        self.docs = []
+        self.changed = asyncio.Event()
+        self.generation = 0
+
+    def kill_cursors(self):
+        self.generation += 1
+        self.changed.set()
+
+
+class WorkerDataManager:
+    """Data manager of one worker, its ObjectIds come from its own clock."""
+    def __init__(self, collection, object_ids=()):
+        self.collection = collection
+        self.object_ids = iter(object_ids)
+
+    async def insertDocuments(self, collection_name, documents):
+        assert collection_name == EVENTS_COLLECTION
+        self.collection.docs.append({"_id": next(self.object_ids), **documents})
+        self.collection.changed.set()
+
+    async def tailDocuments(self, collection_name, query=None, max_await_ms=1000):
+        collection = self.collection
+        generation = collection.generation
+        min_ts = (query or {}).get("ts", {}).get("$gte", 0)
+        position = 0
+        while collection.generation == generation:
+            while position < len(collection.docs):
+                doc = collection.docs[position]
+                position += 1
+                if doc["ts"] >= min_ts:
+                    yield doc
+            collection.changed.clear()
+            await collection.changed.wait()
+
+
+def test_listen_keeps_events_of_two_workers_across_a_reconnect(monkeypatch):
+    monkeypatch.setattr(events, "RECONNECT_DELAY_SEC", 0)
+
+    async def run():
+        collection = CappedCollection()
+        # worker b inserts after worker a within the same second, but its
+        # ObjectId sorts before the one of worker a
+        second = datetime.datetime.fromtimestamp(int(time.time()), datetime.timezone.utc)
+        id_b = ObjectId.from_datetime(second)
+        id_a = ObjectId()
+        worker_a = EventBus(WorkerDataManager(collection, [id_a]))
+        worker_b = EventBus(WorkerDataManager(collection, [id_b]))
+        listener = EventBus(WorkerDataManager(collection))
+        received = []
+
+        async def handler(event):
+            received.append(event["payload"]["user"])
+
+        task = asyncio.create_task(listener.listen(handler))
+        await asyncio.sleep(0)
+        await worker_a.publish(TOPICS_CHANGED, user="a", extract=True)
+        await asyncio.sleep(0.01)
+        collection.kill_cursors()
+        await worker_b.publish(TOPICS_CHANGED, user="b", extract=True)
+        await asyncio.sleep(0.01)
+        task.cancel()
+        return id_b < id_a, received
+
+    older_id, received = asyncio.run(run())
+    assert older_id
+    assert received == ["a", "b"]
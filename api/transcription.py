@@ -0,0 +1,161 @@
+import asyncio
+import datetime
+import logging
+import os
+import time
+import uuid
+
+import httpx
+from deepgram import DeepgramClient, PrerecordedOptions
+
+from metrics import timed_call
+
+TRANSCRIPTION_JOBS_COLLECTION = "TranscriptionJob"
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# finished or not, a job is removed by its TTL index after a week
+JOB_RETENTION = datetime.timedelta(days=7)
+
+# long voice notes take a while, the SDK default of 30 s is too short
+DEEPGRAM_TIMEOUT = httpx.Timeout(300.0, connect=10.0)
+
+# workers touch the jobs they hold this often; a queued or running job not
+# touched for STALE_JOB_SEC belongs to a worker that stopped and is failed
+HEARTBEAT_SEC = 60
+STALE_JOB_SEC = 3 * HEARTBEAT_SEC
+
+
+class TranscriptionQueue:
+    """
+    Accepts audio uploads as jobs and transcribes them on a pool of worker
+    tasks with one shared Deepgram client. The job state is stored in the
+    TranscriptionJob collection so any API worker can report it, the audio
+    itself only lives in this process' queue. Jobs a stopped worker left
+    behind cannot be resumed without their audio, they are marked failed.
+    """
+    def __init__(self, data_manager, api_key, on_transcript, workers, max_queued):
+        """
+        :param data_manager: AsyncMongoDBLayer.
+        :param api_key: Deepgram API key.
+        :param on_transcript: Coroutine function (user, transcript) -> journal id.
+        :param workers: Number of jobs transcribed concurrently.
+        :param max_queued: Jobs waiting in the queue before uploads are refused.
+        """
+        self.data_manager = data_manager
+        self.deepgram = DeepgramClient(api_key)
+        self.on_transcript = on_transcript
+        self.workers = workers
+        self.max_queued = max_queued
+        self.queue = asyncio.Queue(maxsize=max_queued)
+        # slots taken by submissions still storing their job document
+        self.reserved = 0
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.logger = logging.getLogger('Zaia')
+
+    def start(self):
+        """Starts the worker tasks and the heartbeat task and returns them."""
+        return ([asyncio.create_task(self.work()) for _ in range(self.workers)] +
+                [asyncio.create_task(self.heartbeat())])
+
+    async def submit(self, user, audio_bytes):
+        """
+        Queues a transcription.
+        :return: The job document.
+        :raises asyncio.QueueFull: When the queue is full.
+        """
+        # the slot is taken before the first await, so the put below cannot fail
+        if self.queue.qsize() + self.reserved >= self.max_queued:
+            raise asyncio.QueueFull()
+        self.reserved += 1
+        try:
+            now = int(time.time())
+            job = {"id": str(uuid.uuid4()),
+                   "user": user,
+                   "status": QUEUED,
+                   "size": len(audio_bytes),
+                   "created_on": now,
+                   "modified_on": now}
+            stored = {**job,
+                      "owner": self.owner,
+                      "heartbeat_on": now,
+                      "expires_at": datetime.datetime.now(datetime.timezone.utc) + JOB_RETENTION}
+            await self.data_manager.insertDocuments(collection_name=TRANSCRIPTION_JOBS_COLLECTION,
+                                                    documents=stored)
+            self.queue.put_nowait((job["id"], user, audio_bytes))
+        finally:
+            self.reserved -= 1
+        return job
+
+    async def get_job(self, job_id):
+        jobs = await self.data_manager.searchDocument(collection_name=TRANSCRIPTION_JOBS_COLLECTION,
+                                                      query={"id": job_id})
+        return jobs[0] if len(jobs) > 0 else None
+
+    async def heartbeat(self):
+        """Keeps this worker's jobs alive and fails the jobs of workers that stopped."""
+        while True:
+            try:
+                now = int(time.time())
+                await self.data_manager.updateDocument(collection_name=TRANSCRIPTION_JOBS_COLLECTION,
+                                                       query={"owner": self.owner,
+                                                              "status": {"$in": [QUEUED, RUNNING]}},
+                                                       update={"heartbeat_on": now},
+                                                       many=True)
+                result = await self.data_manager.updateDocument(collection_name=TRANSCRIPTION_JOBS_COLLECTION,
+                                                                query={"status": {"$in": [QUEUED, RUNNING]},
+                                                                       "heartbeat_on": {"$lt": now - STALE_JOB_SEC}},
+                                                                update={"status": FAILED,
+                                                                        "error": "interrupted by an API restart, upload again",
+                                                                        "modified_on": now},
+                                                                many=True)
+                if result["modified_count"] > 0:
+                    self.logger.warning(f"Failed {result['modified_count']} orphaned transcription jobs")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Transcription heartbeat failed: {e}")
+            await asyncio.sleep(HEARTBEAT_SEC)
+
+    async def work(self):
+        while True:
+            job_id, user, audio_bytes = await self.queue.get()
+            try:
+                await self.process(job_id, user, audio_bytes)
+            finally:
+                self.queue.task_done()
+
+    async def process(self, job_id, user, audio_bytes):
+        try:
+            await self.set_status(job_id, RUNNING)
+            transcript = await self.transcribe(audio_bytes)
+            journal_id = ""
+            if len(transcript) > 0:
+                journal_id = await self.on_transcript(user, transcript)
+            await self.set_status(job_id, DONE, transcript=transcript, journal_id=journal_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.error(f"Transcription job {job_id} failed: {e}")
+            try:
+                await self.set_status(job_id, FAILED, error=str(e))
+            except Exception as e:
+                self.logger.error(f"Cannot store the failure of transcription job {job_id}: {e}")
+
+    async def transcribe(self, audio_bytes):
+        options = PrerecordedOptions(
+            model="nova-3",
+            smart_format=True,
+        )
+        with timed_call("deepgram", "transcribe_file"):
+            response = await self.deepgram.listen.asyncrest.v("1").transcribe_file({"buffer": audio_bytes}, options,
+                                                                                   timeout=DEEPGRAM_TIMEOUT)
+        return response.results.channels[0].alternatives[0].transcript
+
+    async def set_status(self, job_id, status, **fields):
+        await self.data_manager.updateDocument(collection_name=TRANSCRIPTION_JOBS_COLLECTION,
+                                               query={"id": job_id},
+                                               update={"status": status, "modified_on": int(time.time()), **fields})
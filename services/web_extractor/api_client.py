@@ -1,4 +1,7 @@
+import json
 import logging
+import threading
+import time
 
 import requests
 
@@ -9,6 +12,8 @@ class APIClient:
         self.logger = self.setLogger()
         
         self.session = requests.Session()
+        # topic workers share the client, only one of them refreshes an expired token
+        self.refresh_lock = threading.Lock()
         (self.access_token, self.refresh_token) = self.login(username, password)
     
     def setLogger(self):
@@ -58,8 +63,18 @@ class APIClient:
             self.logger.error(f"Login failed: {e}")
             return None, None
         
-    def refresh_access_token(self):
-        """Refresh the access token using the refresh token."""
+    def refresh_access_token(self, expired_token=None):
+        """
+        Refresh the access token using the refresh token.
+        :param expired_token: The token a request was rejected with. If another
+            thread replaced it meanwhile, the new token is used as is.
+        """
+        with self.refresh_lock:
+            if expired_token is not None and self.access_token != expired_token:
+                return True
+            return self.refresh_access_token_locked()
+
+    def refresh_access_token_locked(self):
         if not self.refresh_token:
             self.logger.error("No refresh token available. Please log in again.")
             return False
@@ -95,13 +110,14 @@ class APIClient:
         url = f"{self.base_url}/{endpoint}/"
 
         try:
+            access_token = self.access_token
             response = self.session.request(method, url, params=params, json=json)
             
             # If access token is expired, try refreshing it once
             if response.status_code == 401:
                 self.logger.warning("Access token expired. Attempting to refresh...")
 
-                if self.refresh_access_token():
+                if self.refresh_access_token(expired_token=access_token):
                     response = self.session.request(method, url, params=params, json=json)
                 else:
                     self.logger.error("Token refresh failed. Please log in again.")
@@ -123,4 +139,39 @@ class APIClient:
 
     def put_data(self, endpoint, payload):
         """Send data to the API with token refresh support."""
-        return self.request_with_retries("PUT", endpoint, json=payload)
\ No newline at end of file
+        return self.request_with_retries("PUT", endpoint, json=payload)
+
+    def listen_events(self, endpoint, on_event, reconnect_delay=1, max_reconnect_delay=60):
+        """
+        Follows a server-sent events endpoint and calls on_event(kind, data) for
+        every event. Never returns, reconnects with backoff; run it in a thread.
+        """
+        url = f"{self.base_url}/{endpoint}/"
+        delay = reconnect_delay
+        while True:
+            try:
+                headers = {"Authorization": f"Bearer {self.access_token}", "Accept": "text/event-stream"}
+                # the server sends a keepalive every 15 s, a silent connection is a dead one
+                with requests.get(url, headers=headers, stream=True, timeout=(10, 60)) as response:
+                    if response.status_code == 401:
+                        self.logger.warning("Access token expired. Attempting to refresh...")
+                        self.refresh_access_token(expired_token=headers["Authorization"][len("Bearer "):])
+                    else:
+                        response.raise_for_status()
+                        self.logger.info(f"Listening to {endpoint}")
+                        delay = reconnect_delay
+                        kind, data = "message", []
+                        # chunk_size=None hands over every chunk as soon as it arrives
+                        for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                            if line == "":
+                                if len(data) > 0:
+                                    on_event(kind, json.loads("\n".join(data)))
+                                kind, data = "message", []
+                            elif line.startswith("event:"):
+                                kind = line[len("event:"):].strip()
+                            elif line.startswith("data:"):
+                                data.append(line[len("data:"):].strip())
+            except (requests.exceptions.RequestException, ValueError) as e:
+                self.logger.error(f"Event stream {endpoint} lost: {e}")
+            time.sleep(delay)
+            delay = min(delay * 2, max_reconnect_delay)
@@ -2,15 +2,33 @@ import requests
 from bs4 import BeautifulSoup
 
 import logging
+import threading
+from contextlib import nullcontext
 
 from services.web_extractor.prompts import *
 from services.web_extractor.llm_wrappers import OpenAILLMWrapper
+from http_session import get_session
+
+def stage_slots(limit):
+    """Bounds how many threads run a stage at once, None means no bound."""
+    return threading.BoundedSemaphore(limit) if limit else nullcontext()
+
 
 class ItemExtractor:
-    def __init__(self, apikey_llm):
+    def __init__(self, apikey_llm, max_fetches=None, max_llm_calls=None, page_cache=None, llm_cache=None):
+        """
+        Safe to share between threads.
+        :param max_fetches: Page downloads running at the same time, None for no limit.
+        :param max_llm_calls: LLM requests running at the same time, None for no limit.
+        :param page_cache: Optional PageCache for the downloaded pages.
+        :param llm_cache: Optional LLMResponseCache for the LLM answers.
+        """
         self.model_engine = 'gpt-4o-mini'
         self.logger = self.setLogger()
-        self.llm_wrapper = OpenAILLMWrapper(api_key =apikey_llm)
+        self.llm_wrapper = OpenAILLMWrapper(api_key =apikey_llm, cache=llm_cache)
+        self.fetch_slots = stage_slots(max_fetches)
+        self.llm_slots = stage_slots(max_llm_calls)
+        self.page_cache = page_cache
         
 
     def setLogger(self):
@@ -38,11 +56,13 @@ class ItemExtractor:
     
     def extract_single_item_from_url(self, url, item_type, return_full_text=False):
         self.logger.info(url)
-        text = self.get_text(url)
+        with self.fetch_slots:
+            text = self.get_text(url)
         if len(text)==0:
             self.logger.error('Text was not extracted')
             return None, ""
-        summary = self.get_summary(text, item_type)
+        with self.llm_slots:
+            summary = self.get_summary(text, item_type)
         if return_full_text:
             return summary, text
         else:
@@ -50,11 +70,13 @@ class ItemExtractor:
     
     def extract_multiple_items_from_url(self, url, items, return_full_text=False):
         self.logger.info(url)
-        text = self.get_text(url)
+        with self.fetch_slots:
+            text = self.get_text(url)
         if len(text)==0:
             self.logger.error('Text was not extracted')
             return None, ""
-        item_extraction = self.extract_items(text, items)
+        with self.llm_slots:
+            item_extraction = self.extract_items(text, items)
         if return_full_text:
             return item_extraction, text
         else:
@@ -63,18 +85,36 @@ class ItemExtractor:
     def get_text(self, url):
         if 'arxiv.org' in url:
             url = url.replace('pdf', 'html')
+        cached = self.page_cache.lookup(url) if self.page_cache is not None else None
+        if cached is not None and cached.fresh:
+            return cached.text
         headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
         }
+        if cached is not None:
+            headers.update(cached.conditional_headers())
         clean_text = ''
         try:
-            response = requests.get(url, headers=headers, timeout=10, allow_redirects=True)
+            response = get_session().get(url, headers=headers, allow_redirects=True)
+            if cached is not None and response.status_code == 304:
+                self.page_cache.mark_revalidated(url)
+                return cached.text
             response.raise_for_status()
             content = response.text
             soup = BeautifulSoup(content, "html.parser")
             clean_text = soup.get_text(separator="\n", strip=True)
+            if self.page_cache is not None and len(clean_text) > 0:
+                self.page_cache.store(url, response.content, clean_text,
+                                      etag=response.headers.get("ETag"),
+                                      last_modified=response.headers.get("Last-Modified"))
         except requests.exceptions.RequestException as e:
             self.logger.error(f"Error: {e}")
+            if cached is not None:
+                # the origin is down, the stale copy beats an empty article
+                return cached.text
+        except OSError as e:
+            # a full or broken cache folder must not cost the extracted text
+            self.logger.error(f"Page cache error: {e}")
         
         return clean_text
     
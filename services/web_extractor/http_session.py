@@ -0,0 +1,78 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry, make_headers
+
+CONNECT_TIMEOUT_SEC = 5
+READ_TIMEOUT_SEC = 15
+DEFAULT_TIMEOUT = (CONNECT_TIMEOUT_SEC, READ_TIMEOUT_SEC)
+
+# hosts whose pools are kept, and connections kept open per host; with
+# pool_block a worker waits for a free connection instead of opening more
+POOL_HOSTS = 32
+CONNECTIONS_PER_HOST = 4
+
+RETRIES = 3
+# waits about 0.5, 1, 2 s between attempts, plus up to 0.5 s of jitter so
+# workers hitting the same host do not retry in lockstep
+BACKOFF_FACTOR = 0.5
+BACKOFF_JITTER = 0.5
+BACKOFF_MAX_SEC = 10
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter with a default timeout, requests has none."""
+    def __init__(self, timeout=DEFAULT_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def create_session(timeout=DEFAULT_TIMEOUT, retries=RETRIES, connections_per_host=CONNECTIONS_PER_HOST):
+    """
+    requests.Session with keep-alive pools, a connection limit per host,
+    default timeouts and retries with exponential backoff on connection
+    errors, 429 and 5xx. Retry-After sent with a 429 or 503 is honoured.
+    After the last retry the error response is returned, not raised.
+    """
+    retry = Retry(total=retries,
+                  connect=retries,
+                  read=retries,
+                  status=retries,
+                  status_forcelist=RETRY_STATUSES,
+                  allowed_methods=["GET", "HEAD"],
+                  backoff_factor=BACKOFF_FACTOR,
+                  backoff_jitter=BACKOFF_JITTER,
+                  backoff_max=BACKOFF_MAX_SEC,
+                  respect_retry_after_header=True,
+                  raise_on_status=False)
+    adapter = TimeoutHTTPAdapter(timeout=timeout,
+                                 max_retries=retry,
+                                 pool_connections=POOL_HOSTS,
+                                 pool_maxsize=connections_per_host,
+                                 pool_block=True)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # gzip and deflate, plus br and zstd when their decoders are installed
+    session.headers.update(make_headers(accept_encoding=True))
+    return session
+
+
+def get_session():
+    """The session shared by all outbound fetchers of the process."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+    return _session
@@ -1,18 +1,103 @@
 from typing import Protocol
+import hashlib
 import json
+import sqlite3
+import threading
+import time
 
 import openai
 import logging
 
+# sampling parameters of every request, part of the cache key
+COMPLETION_PARAMS = {"temperature": 0, "top_p": 0.95, "frequency_penalty": 0, "presence_penalty": 0}
+
 class LLMWrapper(Protocol):
     def get_answer(self, system_message, prompt, model_engine): pass
     def get_prompt_limit(self, model_engine): pass
 
 
+class LLMResponseCache:
+    """
+    SQLite cache of LLM answers keyed by a hash of the model, the messages,
+    the response format and the sampling parameters. Requests run with
+    temperature 0, so a repeated prompt gets the stored answer instead of a
+    new completion. Entries expire after ttl_sec, and the least recently
+    used ones are evicted once the answers exceed max_bytes.
+    Safe to share between threads.
+    """
+    def __init__(self, path, ttl_sec, max_bytes):
+        self.ttl_sec = ttl_sec
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # a hit writes used_on, WAL without a sync per commit keeps it far below a completion
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        with self.lock, self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                   key TEXT PRIMARY KEY,
+                                   answer TEXT NOT NULL,
+                                   size INTEGER NOT NULL,
+                                   created_on REAL NOT NULL,
+                                   used_on REAL NOT NULL)""")
+            self.db.execute("CREATE INDEX IF NOT EXISTS responses_used_on ON responses (used_on)")
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, model_engine, system_message, prompt, response_format=None):
+        material = json.dumps([model_engine, system_message, prompt, response_format, COMPLETION_PARAMS],
+                              sort_keys=True)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock, self.db:
+            row = self.db.execute("SELECT answer FROM responses WHERE key = ? AND created_on > ?",
+                                  (key, now - self.ttl_sec)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.db.execute("UPDATE responses SET used_on = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def set(self, key, answer):
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                            (key, answer, len(answer.encode("utf-8")), now, now))
+            self.evict(now)
+
+    def evict(self, now):
+        """Drops expired answers, then the least recently used ones until the cache fits. Call with the lock."""
+        self.db.execute("DELETE FROM responses WHERE created_on <= ?", (now - self.ttl_sec,))
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY used_on").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+
+    def stats(self):
+        with self.lock:
+            entries, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            lookups = self.hits + self.misses
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "hit_rate": round(self.hits / lookups, 4) if lookups > 0 else 0.0,
+                    "entries": entries,
+                    "bytes": size,
+                    "max_bytes": self.max_bytes}
+
+
 class OpenAILLMWrapper(LLMWrapper):
-    def __init__(self, api_key):
+    def __init__(self, api_key, cache=None):
+        """:param cache: Optional LLMResponseCache, answers served from it return no usage."""
         self.logger = self.setLogger()
         openai.api_key = api_key
+        self.cache = cache
 
     def setLogger(self):
         log = logging.getLogger('Zaia_LLMWrapper')
@@ -39,16 +124,21 @@ class OpenAILLMWrapper(LLMWrapper):
             {"role": "system", "content": system_message},
             {"role": "user", "content": prompt}
         ]
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(model_engine, system_message, prompt)
+            answer = self.cache.get(key)
+            if answer is not None:
+                return (answer, None)
         try:
             completion = openai.chat.completions.create(model=model_engine,
                                                     messages=messages,
-                                                    temperature=0,
-                                                    top_p=0.95,
-                                                    frequency_penalty=0,
-                                                    presence_penalty=0,
-                                                    stop=None)
+                                                    stop=None,
+                                                    **COMPLETION_PARAMS)
             answer = completion.choices[0].message.content
             usage = completion.usage
+            if key is not None and answer is not None:
+                self.cache.set(key, answer)
             return (answer, usage)
         except Exception as e:
             self.logger.error(e)
@@ -59,20 +149,27 @@ class OpenAILLMWrapper(LLMWrapper):
             {"role": "system", "content": system_message},
             {"role": "user", "content": prompt}
         ]
+        response_format = {"type": "json_object"}
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(model_engine, system_message, prompt, response_format)
+            answer = self.cache.get(key)
+            if answer is not None:
+                return (json.loads(answer), None)
         try:
             completion = openai.chat.completions.create(model=model_engine,
                                                     messages=messages,
-                                                    temperature=0,
-                                                    top_p=0.95,
-                                                    frequency_penalty=0,
-                                                    presence_penalty=0,
                                                     stop=None,
-                                                    response_format={"type": "json_object"} 
+                                                    response_format=response_format,
+                                                    **COMPLETION_PARAMS
                                                     )
             answer = completion.choices[0].message.content
             usage = completion.usage
             try:
                 extracted_data = json.loads(answer)
+                # only answers that parse are cached, a broken one is asked again
+                if key is not None:
+                    self.cache.set(key, answer)
                 return (extracted_data, usage)
 
             except json.JSONDecodeError:
@@ -1,6 +1,7 @@
-import requests
 import logging
 
+from http_session import get_session
+
 class GNewsNewsSearchClient:
     def __init__(self, api_key):
         self.logger = self.setLogger()
@@ -38,7 +39,7 @@ class GNewsNewsSearchClient:
             "token": self.api_key
         }
         
-        response = requests.get(url, params=params)
+        response = get_session().get(url, params=params)
         data = response.json()
         articles = []
         extracted_description = []
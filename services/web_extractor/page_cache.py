@@ -0,0 +1,200 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+INDEX_FILE = "index.db"
+BLOBS_FOLDER = "blobs"
+
+# query parameters that only track where a click came from
+TRACKING_PARAMS = ("utm_", "fbclid", "gclid", "mc_cid", "mc_eid", "ref_src")
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def canonical_url(url):
+    """
+    Cache key of a URL: lower case scheme and host, no default port, no
+    fragment, no tracking parameters and the remaining parameters sorted.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if not k.lower().startswith(TRACKING_PARAMS))
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), ""))
+
+
+class CachedPage:
+    def __init__(self, text, etag, last_modified, fresh):
+        self.text = text
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fresh = fresh
+
+    def conditional_headers(self):
+        """Headers that let the server answer 304 if the page did not change."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class PageCache:
+    """
+    On-disk cache of fetched pages and the text extracted from them, keyed
+    by canonical URL. Page and text are stored as zlib compressed blobs named
+    by the SHA-256 of their content, so URLs serving the same page share the
+    blobs. A SQLite index maps URLs to blobs along with the validators
+    (ETag, Last-Modified) used to revalidate stale entries.
+
+    Entries younger than fresh_sec are served without any request. The
+    least recently used entries are evicted once the blobs exceed max_bytes.
+    Safe to share between threads.
+    """
+    def __init__(self, folder, max_bytes, fresh_sec):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.fresh_sec = fresh_sec
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(folder, INDEX_FILE), check_same_thread=False)
+        columns = {x[1] for x in self.db.execute("PRAGMA table_info(pages)")}
+        if "size" in columns:
+            # the first layout summed shared blobs once per URL, start over
+            with self.db:
+                self.db.execute("DROP TABLE pages")
+            shutil.rmtree(os.path.join(folder, BLOBS_FOLDER), ignore_errors=True)
+        os.makedirs(os.path.join(folder, BLOBS_FOLDER), exist_ok=True)
+        with self.lock, self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS pages (
+                                   url TEXT PRIMARY KEY,
+                                   page_digest TEXT NOT NULL,
+                                   text_digest TEXT NOT NULL,
+                                   etag TEXT,
+                                   last_modified TEXT,
+                                   page_size INTEGER NOT NULL,
+                                   text_size INTEGER NOT NULL,
+                                   fetched_on REAL NOT NULL,
+                                   used_on REAL NOT NULL)""")
+            self.db.execute("CREATE INDEX IF NOT EXISTS pages_used_on ON pages (used_on)")
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def blob_path(self, digest):
+        return os.path.join(self.folder, BLOBS_FOLDER, digest[:2], digest)
+
+    def write_blob(self, data):
+        """Stores data under its digest, an existing blob is the same content and is kept."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(zlib.compress(data))
+            os.replace(tmp_path, path)
+        return digest, os.path.getsize(path)
+
+    def read_blob(self, digest):
+        with open(self.blob_path(digest), "rb") as f:
+            return zlib.decompress(f.read())
+
+    def lookup(self, url):
+        """
+        :return: CachedPage, or None when the URL is not cached.
+        """
+        key = canonical_url(url)
+        with self.lock:
+            row = self.db.execute("SELECT text_digest, etag, last_modified, fetched_on FROM pages WHERE url = ?",
+                                  (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            with self.db:
+                self.db.execute("UPDATE pages SET used_on = ? WHERE url = ?", (time.time(), key))
+        text_digest, etag, last_modified, fetched_on = row
+        try:
+            text = self.read_blob(text_digest).decode("utf-8")
+        except (OSError, zlib.error):
+            self.forget(key)
+            with self.lock:
+                self.misses += 1
+            return None
+        fresh = time.time() - fetched_on < self.fresh_sec
+        with self.lock:
+            if fresh:
+                self.hits += 1
+        return CachedPage(text, etag, last_modified, fresh)
+
+    def store(self, url, page, text, etag=None, last_modified=None):
+        """
+        Caches a downloaded page and its extracted text.
+        :param page: Response body as bytes.
+        """
+        page_digest, page_size = self.write_blob(page)
+        text_digest, text_size = self.write_blob(text.encode("utf-8"))
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (canonical_url(url), page_digest, text_digest, etag, last_modified,
+                             page_size, text_size, now, now))
+        self.evict()
+
+    def mark_revalidated(self, url):
+        """The server answered 304, the entry is fresh again."""
+        with self.lock, self.db:
+            self.db.execute("UPDATE pages SET fetched_on = ? WHERE url = ?", (time.time(), canonical_url(url)))
+            self.revalidated += 1
+
+    def forget(self, key):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM pages WHERE url = ?", (key,))
+
+    def blob_bytes(self):
+        """Size of the blobs on disk, a blob shared by several URLs counts once."""
+        return self.db.execute("""SELECT COALESCE(SUM(size), 0) FROM (
+                                      SELECT page_digest AS digest, page_size AS size FROM pages
+                                      UNION
+                                      SELECT text_digest, text_size FROM pages)""").fetchone()[0]
+
+    def total_bytes(self):
+        with self.lock:
+            return self.blob_bytes()
+
+    def evict(self):
+        """Drops least recently used entries until the cache fits in max_bytes."""
+        if self.total_bytes() <= self.max_bytes:
+            return
+        with self.lock, self.db:
+            total = self.blob_bytes()
+            for url, page_digest, text_digest, page_size, text_size in self.db.execute(
+                    "SELECT url, page_digest, text_digest, page_size, text_size FROM pages ORDER BY used_on").fetchall():
+                if total <= self.max_bytes:
+                    break
+                self.db.execute("DELETE FROM pages WHERE url = ?", (url,))
+                # a blob can be shared with URLs that stay
+                for digest, size in {(page_digest, page_size), (text_digest, text_size)}:
+                    in_use = self.db.execute("SELECT 1 FROM pages WHERE page_digest = ? OR text_digest = ? LIMIT 1",
+                                             (digest, digest)).fetchone()
+                    if in_use is None:
+                        total -= size
+                        try:
+                            os.remove(self.blob_path(digest))
+                        except FileNotFoundError:
+                            pass
+
+    def stats(self):
+        return {"hits": self.hits,
+                "revalidated": self.revalidated,
+                "misses": self.misses,
+                "bytes": self.total_bytes(),
+                "max_bytes": self.max_bytes}
@@ -1,10 +1,10 @@
 import logging
 import uuid
-import os
 import argparse
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import json
 
 from  dotenv  import load_dotenv
 from pydantic_settings import BaseSettings
@@ -12,9 +12,12 @@ from pydantic_settings import BaseSettings
 from api_client import APIClient
 from web_search_extactor import WebSearchExtractor
 from TTS_clients import AmazonTextToSpeech
+from page_cache import PageCache
+from llm_wrappers import LLMResponseCache
 
-SHARED_DIR = "/data"
-SHARED_FILE = "shared.json"
+TOPIC_EVENTS_ENDPOINT = "topic_events"
+RETRY_AFTER_ERROR_SEC = 60
+S3_PREFIX = 'All'
 
 def read_docker_secret(secret_name):
     secret_path = Path(f"/run/secrets/{secret_name}")
@@ -35,6 +38,16 @@ class Settings(BaseSettings):
     S3_REGION: str = read_docker_secret("S3_REGION")
     ZAIA_API_USER: str = read_docker_secret("ZAIA_API_USER")
     ZAIA_API_PASSWORD: str = read_docker_secret("ZAIA_API_PASSWORD") 
+    ARTICLE_WORKERS: int = 4
+    MAX_PAGE_FETCHES: int = 4
+    MAX_LLM_CALLS: int = 4
+    TOPIC_WORKERS: int = 4
+    PAGE_CACHE_DIR: str = "page_cache"
+    PAGE_CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+    PAGE_CACHE_FRESH_SEC: int = 6 * 3600
+    LLM_CACHE_PATH: str = "llm_cache.db"
+    LLM_CACHE_TTL_SEC: int = 30 * 86400
+    LLM_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
 
     class Config:
         env_file = ".env" 
@@ -80,16 +93,119 @@ def setLogger():
 
 
 
+def is_due(topic):
+    if topic['topic_type'] not in ["web", "news"]:
+        return False
+    if "last_extraction_epoch" in topic and  topic['topic_type']=='web':
+        return False
+    last_extraction_epoch = topic.get("last_extraction_epoch", time.time()-31*86400)
+    frequency = frequency_map_in_sec.get(topic['frequency'], 0)
+    return time.time() > last_extraction_epoch + frequency
+
+
+def process_topic(api, tts, ws_extractor, topic):
+    """
+    Searches, extracts and stores the new items of one topic. The topic's
+    last_extraction_epoch only moves when the items were stored, a topic
+    that fails is picked up again next round.
+    Raises on failure.
+    """
+    logger = logging.getLogger('Zaia')
+    logger.info(f"Topic: {topic}")
+    last_extraction_epoch = topic.get("last_extraction_epoch", time.time()-31*86400)
+    extracted_urls = api.get_data('items', {"topic_id": topic['id'], "user": topic['user']})
+    if extracted_urls is None:
+        raise RuntimeError("cannot read the extracted items")
+    extracted_urls = [x['source'].split('?')[0] for x in extracted_urls]
+    extracted_items_single, extracted_items_multi = ws_extractor.get_search_and_extractions(topic, last_extraction_epoch, extracted_urls)
+   
+    extracted_items_to_insert_single = []
+    extracted_items_to_insert_multi = []
+    
+    # inser for summary (single item)
+    for res in extracted_items_single:
+        
+        now = int(time.time())
+        id = str(uuid.uuid4())
+        audio_name = id + '.mp3'
+        extracted_items_to_insert_single.append({
+            "id": id,
+            "topic_id": topic['id'],
+            "item_name": res['item_name'],#in list
+            "source": res['url'],
+            "title": res['title'],
+            "value": res['value'],#in list
+            "audio_name": audio_name,#in list
+            "comments": [],
+            "done": False,
+            "created_on": now,
+            "modified_on": now,
+            })
+    if len(extracted_items_to_insert_single)  > 0:
+        logger.info(f"extracted_items_to_insert_single: {len(extracted_items_to_insert_single)}")
+        if api.post_data("insert_items", payload=extracted_items_to_insert_single) is None:
+            raise RuntimeError("cannot insert the items")
+        for item in extracted_items_to_insert_single:
+            try: 
+                s3_bucket_name = f"{S3_PREFIX}/{item['audio_name']}"
+                text_for_tts = f"Title: \n {item['title']} \n"
+                text_for_tts += f"Summary: \n {item['value']} \n"
+                tts.synthesize_and_upload_to_s3(text = text_for_tts, 
+                                                mp3_filepath=s3_bucket_name)
+            except Exception  as e:
+                logger.error(f'Problem with TTS: {e}')
+
+    else:
+        logger.info('Zero results for items')
+    
+    # insert for extraction (multi item)
+    for res in extracted_items_multi:
+
+        now = int(time.time())
+        id = str(uuid.uuid4())
+        extracted_items_to_insert_multi.append({
+            "id": id,
+            "topic_id": topic['id'],
+            "items": res["items"],
+            "source": res['url'],
+            "title": res['title'],
+            "comments": [],
+            "done": False,
+            "created_on": now,
+            "modified_on": now,
+            })
+    if len(extracted_items_to_insert_multi)  > 0:
+        logger.info(f"extracted_items_to_insert_multi: {len(extracted_items_to_insert_multi)}")
+        if api.post_data("insert_multi_items", payload=extracted_items_to_insert_multi) is None:
+            raise RuntimeError("cannot insert the multi items")
+        
+    else:
+        logger.info('Zero results for multiitems')
+    if api.put_data("update_topic", payload={"id": topic['id'], "last_extraction_epoch": int(time.time())}) is None:
+        raise RuntimeError("cannot update last_extraction_epoch")
+    logger.info(f"Finished topic {topic['id']}")
+
+
+def run_topic(api, tts, ws_extractor, topic):
+    """process_topic for the worker pool, a failing topic does not affect the others."""
+    try:
+        process_topic(api, tts, ws_extractor, topic)
+        return True
+    except Exception as e:
+        logging.getLogger('Zaia').error(f"Topic {topic.get('id')} failed: {e}")
+        return False
+
+
 if __name__ == "__main__": 
     logger = setLogger()
     load_dotenv()
 
-    last_time_topics_changed_local = 0
     last_time_run = 0
     sec_between_scheduled_runs = 3600
-    s3_prefix = 'All'
     parser = argparse.ArgumentParser(description="Run WS Extraction Service service")
     parser.add_argument("env", choices=["local", "cloud"], help="Environment to use (local/cloud)")
+    parser.add_argument("--topic-workers", type=int, default=settings.TOPIC_WORKERS,
+                        help="Topics processed at the same time, 1 processes them one by one")
     args = parser.parse_args()
     api_base_url = get_api_base_url(args.env)
     logger.info(f'Base API url: {api_base_url}')
@@ -98,118 +214,52 @@ if __name__ == "__main__":
                              secret_key=settings.S3_SECRET_KEY,
                              region=settings.S3_REGION,
                              bucket_name=settings.S3_BUCKET_NAME)
+    page_cache = PageCache(settings.PAGE_CACHE_DIR,
+                           max_bytes=settings.PAGE_CACHE_MAX_BYTES,
+                           fresh_sec=settings.PAGE_CACHE_FRESH_SEC)
+    llm_cache = LLMResponseCache(settings.LLM_CACHE_PATH,
+                                 ttl_sec=settings.LLM_CACHE_TTL_SEC,
+                                 max_bytes=settings.LLM_CACHE_MAX_BYTES)
+    # shared by all topic workers, so the fetch and LLM limits hold for the whole round
+    ws_extractor = WebSearchExtractor(apikey_news=settings.API_KEY_GNEWS,
+                                    apikey_search=settings.API_KEY_GOOGLE,
+                                    google_cse_id=settings.GOOGLE_CSE_ID,
+                                    apikey_llm=settings.API_KEY_OPEN_AI,
+                                    max_articles=settings.ARTICLE_WORKERS,
+                                    max_fetches=settings.MAX_PAGE_FETCHES,
+                                    max_llm_calls=settings.MAX_LLM_CALLS,
+                                    page_cache=page_cache,
+                                    llm_cache=llm_cache)
+    topic_pool = ThreadPoolExecutor(max_workers=max(1, args.topic_workers), thread_name_prefix="topic")
+
+    # The API pushes topic changes, the loop sleeps until one arrives or the next scheduled run
+    topics_changed = threading.Event()
+    def on_topic_event(kind, data):
+        if kind == "topics_changed" and data.get("extract", False):
+            topics_changed.set()
+    threading.Thread(target=api.listen_events, args=(TOPIC_EVENTS_ENDPOINT, on_topic_event),
+                     name="topic_events", daemon=True).start()
+
     while True:
         try: 
-            shouldRunService = False
-            if last_time_run + sec_between_scheduled_runs < time.time():
-                shouldRunService = True
-                last_time_topics_changed_local = time.time()
+            if topics_changed.wait(timeout=max(0, last_time_run + sec_between_scheduled_runs - time.time())):
+                logger.info('Will run the service on trigger')
+            else:
                 logger.info('Will run the service on schedule')
-            else: 
-                file_path = os.path.join(SHARED_DIR, SHARED_FILE)
-                if os.path.exists(file_path):
-                    try:
-                        with open(file_path, "r") as f:
-                            data = json.load(f)
-                        last_time_topics_changed = data['last_time_topics_changed']
-                        if last_time_topics_changed > last_time_topics_changed_local:
-                            shouldRunService = True
-                            logger.info('Will run the service on trigger')
-                            last_time_topics_changed_local = last_time_topics_changed
-                    except:
-                        logger.error('Cannot open the file')
-                
-            
-            if shouldRunService:
-
-                topics = api.get_data("all_topics")
-                ws_extractor = WebSearchExtractor(apikey_news=settings.API_KEY_GNEWS,
-                                                apikey_search=settings.API_KEY_GOOGLE,
-                                                google_cse_id=settings.GOOGLE_CSE_ID,
-                                                apikey_llm=settings.API_KEY_OPEN_AI )
-                if topics is None:
-                    time.sleep(3600)
-                    continue
-                for topic in topics:
-                    if topic['topic_type'] not in ["web", "news"]:
-                        continue
-                    if "last_extraction_epoch" in topic and  topic['topic_type']=='web':
-                        continue
-                    logger.info(f"Topic: {topic}")
-                    last_extraction_epoch = topic.get("last_extraction_epoch", time.time()-31*86400)
-                    frequency = frequency_map_in_sec.get(topic['frequency'], 0)
-                    if time.time() > last_extraction_epoch + frequency:
-                        extracted_urls = api.get_data('items', {"topic_id": topic['id'], "user": topic['user']})
-                        extracted_urls = [x['source'].split('?')[0] for x in extracted_urls]
-                        extracted_items_single, extracted_items_multi = ws_extractor.get_search_and_extractions(topic, last_extraction_epoch, extracted_urls)
-                       
-                        extracted_items_to_insert_single = []
-                        extracted_items_to_insert_multi = []
-                        
-                        # inser for summary (single item)
-                        for res in extracted_items_single:
-                            
-                            now = int(time.time())
-                            id = str(uuid.uuid4())
-                            audio_name = id + '.mp3'
-                            extracted_items_to_insert_single.append({
-                                "id": id,
-                                "topic_id": topic['id'],
-                                "item_name": res['item_name'],#in list
-                                "source": res['url'],
-                                "title": res['title'],
-                                "value": res['value'],#in list
-                                "audio_name": audio_name,#in list
-                                "comments": [],
-                                "done": False,
-                                "created_on": now,
-                                "modified_on": now,
-                                })
-                        if len(extracted_items_to_insert_single)  > 0:
-                            logger.info(f"extracted_items_to_insert_single: {len(extracted_items_to_insert_single)}")
-                            api.post_data("insert_items", payload=extracted_items_to_insert_single)
-                            for item in extracted_items_to_insert_single:
-                                try: 
-                                    s3_bucket_name = f"{s3_prefix}/{item['audio_name']}"
-                                    text_for_tts = f"Title: \n {item['title']} \n"
-                                    text_for_tts += f"Summary: \n {item['value']} \n"
-                                    tts.synthesize_and_upload_to_s3(text = text_for_tts, 
-                                                                    mp3_filepath=s3_bucket_name)
-                                except Exception  as e:
-                                    logger.error(f'Problem with TTS: {e}')
-
-                        else:
-                            logger.info('Zero results for items')
-                        
-                        # insert for extraction (multi item)
-                        for res in extracted_items_multi:
-                   
-                            now = int(time.time())
-                            id = str(uuid.uuid4())
-                            extracted_items_to_insert_multi.append({
-                                "id": id,
-                                "topic_id": topic['id'],
-                                "items": res["items"],
-                                "source": res['url'],
-                                "title": res['title'],
-                                "comments": [],
-                                "done": False,
-                                "created_on": now,
-                                "modified_on": now,
-                                })
-                        if len(extracted_items_to_insert_multi)  > 0:
-                            logger.info(f"extracted_items_to_insert_multi: {len(extracted_items_to_insert_multi)}")
-                            api.post_data("insert_multi_items", payload=extracted_items_to_insert_multi)
-                            
-                        else:
-                            logger.info('Zero results for multiitems')
-                        api.put_data("update_topic", payload={"id": topic['id'], "last_extraction_epoch": int(time.time())})
-                        logger.info('Finished for topics')
-                logger.info('Setting last_time_run')
-                last_time_run = int(time.time())
+            topics_changed.clear()
+
+            topics = api.get_data("all_topics")
+            if topics is None:
+                time.sleep(3600)
+                continue
+            due_topics = [x for x in topics if is_due(x)]
+            # the round ends when every due topic finished, successfully or not
+            succeeded = list(topic_pool.map(lambda topic: run_topic(api, tts, ws_extractor, topic), due_topics))
+            logger.info(f"Topics done: {sum(succeeded)} of {len(due_topics)}")
+            logger.info(f"Page cache: {page_cache.stats()}, LLM cache: {llm_cache.stats()}")
+            logger.info('Setting last_time_run')
+            last_time_run = int(time.time())
         except Exception as e:
             logger.error(f"Error on running service: {e}")
+            time.sleep(RETRY_AFTER_ERROR_SEC)
         logger.info('Finished round')
-        
-        time.sleep(60)
-   
@@ -1,5 +1,6 @@
 import datetime
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 from prompts import *
 from news_clients import GNewsNewsSearchClient
@@ -8,12 +9,28 @@ from extractor import ItemExtractor
 
 
 class WebSearchExtractor:
-    def __init__(self, apikey_news, apikey_search, apikey_llm, google_cse_id):
+    def __init__(self, apikey_news, apikey_search, apikey_llm, google_cse_id,
+                 max_articles=1, max_fetches=None, max_llm_calls=None, page_cache=None,
+                 llm_cache=None):
+        """
+        :param max_articles: Articles of a topic processed at the same time, 1 processes them one by one.
+        :param max_fetches: Page downloads in flight across all articles and topics, None for no limit.
+        :param max_llm_calls: LLM requests in flight across all articles and topics, None for no limit.
+        :param page_cache: Optional PageCache shared by all page downloads.
+        :param llm_cache: Optional LLMResponseCache shared by all LLM calls.
+        """
         self.logger = self.setLogger()
         self.apikey_news = apikey_news
         self.apikey_search = apikey_search
         self.apikey_llm = apikey_llm
         self.google_cse_id = google_cse_id
+        self.max_articles = max_articles
+        # one extractor for all topics, its fetch and LLM limits hold across concurrent topics
+        self.item_extractor = ItemExtractor(apikey_llm = self.apikey_llm,
+                                            max_fetches=max_fetches,
+                                            max_llm_calls=max_llm_calls,
+                                            page_cache=page_cache,
+                                            llm_cache=llm_cache)
         
     def setLogger(self):
         log = logging.getLogger('Zaia_ws_extractor')
@@ -47,48 +64,76 @@ class WebSearchExtractor:
             web_search_client = CustomGoogleSearchClient(api_key = self.apikey_search, 
                                                          cse_id=self.google_cse_id)
             articles = web_search_client.fetch_urls(query= topic['topic_name'])
-        item_extractor = ItemExtractor(apikey_llm = self.apikey_llm)
-        extracted_items_single = []
-        extracted_items_multi = []
-        
+
+        # deduplicate before anything is dispatched, also against repeats within the results
+        new_articles = []
         for artilce in articles:
             if artilce['url'] in already_extracted_urls:
                 continue
             already_extracted_urls.append(artilce['url'])
-            
-            if not topic.get('is_multi_item', False):
-                item = topic['items'][0]
-                extraction, full_text = item_extractor.extract_single_item_from_url(artilce['url'], 
-                                                                                    item_type=item['item_type'])
-                if extraction is not None:
-                    extracted_items_single.append({"item_name": item['item_name'],
-                                            "item_type": item['item_type'], 
-                                            "value": extraction,
-                                            "url": artilce['url'],
-                                            "full_text": full_text,
-                                            "title": artilce['title']})
+            new_articles.append(artilce)
+
+        def extract(artilce):
+            return self.extract_article(self.item_extractor, topic, artilce)
+
+        if self.max_articles > 1 and len(new_articles) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.max_articles, len(new_articles)),
+                                    thread_name_prefix="article") as executor:
+                # map keeps the order of the search results, whichever article finishes first
+                results = list(executor.map(extract, new_articles))
+        else:
+            results = [extract(x) for x in new_articles]
+
+        extracted_items_single = []
+        extracted_items_multi = []
+        for result in results:
+            if result is None:
+                continue
+            if topic.get('is_multi_item', False):
+                extracted_items_multi.append(result)
             else:
-                extractions, full_text = item_extractor.extract_multiple_items_from_url(artilce['url'], 
-                                                                                        items =topic['items'])
-                if extractions is not None:
-                    items_values = []
-                    for item in topic['items']:
-                        value = extractions.get(item['item_name'], '')
-                        value_string = ''
-                        if isinstance(value, list):
-                            value_string = "; ".join([str(x) for x in value])
-                        elif isinstance(value, str):
-                            value_string = value
-                        
-                        items_values.append({"item_name": item['item_name'], "value": value_string})
-                    extracted_items_multi.append({"items": items_values,
-                                            "url": artilce['url'],
-                                            "full_text": full_text,
-                                            "title": artilce['title']})
+                extracted_items_single.append(result)
 
         return extracted_items_single, extracted_items_multi
 
 
+    def extract_article(self, item_extractor, topic, artilce):
+        """
+        Fetches one article and extracts the topic's items from it.
+        :return: The extracted item, or None when nothing could be extracted.
+        """
+        if not topic.get('is_multi_item', False):
+            item = topic['items'][0]
+            extraction, full_text = item_extractor.extract_single_item_from_url(artilce['url'], 
+                                                                                item_type=item['item_type'])
+            if extraction is None:
+                return None
+            return {"item_name": item['item_name'],
+                    "item_type": item['item_type'], 
+                    "value": extraction,
+                    "url": artilce['url'],
+                    "full_text": full_text,
+                    "title": artilce['title']}
+
+        extractions, full_text = item_extractor.extract_multiple_items_from_url(artilce['url'], 
+                                                                                items =topic['items'])
+        if extractions is None:
+            return None
+        items_values = []
+        for item in topic['items']:
+            value = extractions.get(item['item_name'], '')
+            value_string = ''
+            if isinstance(value, list):
+                value_string = "; ".join([str(x) for x in value])
+            elif isinstance(value, str):
+                value_string = value
+            
+            items_values.append({"item_name": item['item_name'], "value": value_string})
+        return {"items": items_values,
+                "url": artilce['url'],
+                "full_text": full_text,
+                "title": artilce['title']}
+
     def unix_to_iso8601(self, timestamp):
         """Convert UNIX timestamp to ISO 8601 format (UTC)"""
         return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
@@ -1,5 +1,6 @@
-import requests
 import logging
+
+from http_session import get_session
 class CustomGoogleSearchClient:
     def __init__(self, api_key, cse_id):
         self.logger = self.setLogger()
@@ -40,7 +41,7 @@ class CustomGoogleSearchClient:
             params["dateRestrict"] = f"d{from_date}:d{to_date}"
         results = []
         try:
-            response = requests.get(url, params=params)
+            response = get_session().get(url, params=params)
             data = response.json()
             
             if 'items' in data:
@@ -503,11 +503,11 @@ const fetchItems = async (topicId, search_term, for_reading, only_with_comments,
         body: formData,
       });
 
-      if (response.status === 200) {
-        const result = await response.json();
-        console.log(result)
+      if (response.status === 202) {
+        const job = await response.json();
+        console.log(job)
         await deleteAudioFile(filePath);
-        return result;
+        return await waitForTranscription(job.job_id);
       } else {
         return {"id":"", "transcript": ""};
       }
@@ -517,6 +517,28 @@ const fetchItems = async (topicId, search_term, for_reading, only_with_comments,
     }
   };
 
+  // The upload only queues the transcription, poll the job until it is finished
+  const waitForTranscription = async (jobId, intervalMs = 1000, maxAttempts = 300) => {
+    for (let attempt = 0; attempt < maxAttempts; attempt++) {
+      await new Promise(resolve => setTimeout(resolve, intervalMs));
+      const response = await fetchWithAuth(`transcription_jobs/${jobId}`, {
+        method: 'GET',
+      });
+      if (response.status !== 200) {
+        continue;
+      }
+      const job = await response.json();
+      if (job.status === 'done') {
+        return {"id": job.journal_id, "transcript": job.transcript};
+      }
+      if (job.status === 'failed') {
+        console.error('Transcription failed:', job.error);
+        return {"id":"", "transcript": ""};
+      }
+    }
+    return {"id":"", "transcript": ""};
+  };
+
 // Export functions to use in other files
 export {
     loginUser,